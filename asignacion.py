@@ -0,0 +1,54 @@
+from datetime import date, timedelta
+
+from disponibilidad import plantilla_de_tecnico
+
+
+class AsignadorCarga:
+    """Ranks compatible technicians by their booked load, lightest first.
+
+    The load comes from the appointments index, which keeps a per-technician count
+    of booked blocks per day (rebuilt on each reload, bumped on each local booking),
+    so ranking costs a few dictionary lookups per technician. Three rolling windows
+    are weighted: the day being offered, the next `dias_proximos` days (so nobody's
+    calendar fills up and pushes offers further out) and the last `dias_recientes`
+    days (jobs done). Each is divided by the technician's blocks per day, so a
+    half-day schedule counts as full sooner. Ties go to the name, alphabetically.
+    """
+
+    def __init__(self, indice_citas, dias_recientes=30, dias_proximos=14,
+                 peso_dia=1.0, peso_proximos=1.0, peso_recientes=0.25):
+        self.indice_citas = indice_citas
+        self.dias_recientes = dias_recientes
+        self.dias_proximos = dias_proximos
+        self.peso_dia = peso_dia
+        self.peso_proximos = peso_proximos
+        self.peso_recientes = peso_recientes
+
+    @staticmethod
+    def _dias(desde, cantidad):
+        return tuple((desde + timedelta(days=i)).strftime("%Y-%m-%d") for i in range(cantidad))
+
+    def puntaje(self, tecnico, fecha, proximos=None, recientes=None):
+        """Weighted booked load of a technician row, per block of daily capacity."""
+        hoy = date.today()
+        if proximos is None:
+            proximos = self._dias(hoy, self.dias_proximos)
+        if recientes is None:
+            recientes = self._dias(hoy - timedelta(days=self.dias_recientes), self.dias_recientes)
+        nombre = tecnico["nombre_tecnicos"]
+        carga = (
+            self.peso_dia * self.indice_citas.carga(nombre, (fecha,))
+            + self.peso_proximos * self.indice_citas.carga(nombre, proximos)
+            + self.peso_recientes * self.indice_citas.carga(nombre, recientes)
+        )
+        return carga / max(1, len(plantilla_de_tecnico(tecnico).bloques))
+
+    def ordenar(self, tecnicos, fecha):
+        """Technicians sorted by load for an appointment on `fecha`, lightest first."""
+        hoy = date.today()
+        proximos = self._dias(hoy, self.dias_proximos)
+        recientes = self._dias(hoy - timedelta(days=self.dias_recientes), self.dias_recientes)
+        return sorted(
+            tecnicos,
+            key=lambda t: (self.puntaje(t, fecha, proximos, recientes), t["nombre_tecnicos"])
+        )
@@ -0,0 +1,501 @@
+"""Offline benchmark: drives the app against local stand-ins for SheetDB, Twilio and OpenAI.
+
+    python benchmark.py                      # run and print the report
+    python benchmark.py --guardar-base       # run and save the report as the baseline
+    python benchmark.py --comparar           # run and fail (exit 1) on regressions vs the baseline
+    python benchmark.py --contrato           # check the SQLite repository answers like the SheetDB one
+"""
+import argparse
+import contextlib
+import fnmatch
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, unquote, urlparse
+
+RUTA_BASE = Path(__file__).resolve().parent / "benchmark_baseline.json"
+
+# Allowed slack before a metric counts as a regression
+TOLERANCIA_LATENCIA = 0.25
+TOLERANCIA_LLAMADAS = 0.05
+TOLERANCIA_RITMO = 0.25
+
+
+class Registro:
+    """Counts outbound calls per backend and endpoint."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.llamadas = Counter()
+
+    def anotar(self, backend, endpoint):
+        with self._lock:
+            self.llamadas[(backend, endpoint)] += 1
+
+    def por_backend(self):
+        with self._lock:
+            totales = Counter()
+            for (backend, _), n in self.llamadas.items():
+                totales[backend] += n
+            return dict(totales)
+
+    def reiniciar(self):
+        with self._lock:
+            self.llamadas.clear()
+
+
+class _Servidor(ThreadingHTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _Manejador(BaseHTTPRequestHandler):
+    """Base handler: latency injection, JSON helpers and quiet logs."""
+    backend = ""
+    latencia = 0.0
+    registro = None
+
+    def log_message(self, *args):
+        pass
+
+    def _cuerpo(self):
+        largo = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(largo) if largo else b""
+
+    def _json(self, estado, datos):
+        cuerpo = json.dumps(datos).encode()
+        self.send_response(estado)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def _esperar(self, endpoint):
+        self.registro.anotar(self.backend, endpoint)
+        if self.latencia:
+            time.sleep(self.latencia)
+
+
+class HojaFalsa:
+    """Rows of one fake sheet, guarded by a lock."""
+
+    def __init__(self, filas):
+        self.filas = filas
+        self.lock = threading.Lock()
+
+
+def _coincide(fila, filtros):
+    # SheetDB search: case-insensitive, '*' as wildcard
+    return all(fnmatch.fnmatch(str(fila.get(k, "")).lower(), v.lower()) for k, v in filtros.items())
+
+
+def manejador_sheetdb(hojas, latencia, registro):
+    """SheetDB stand-in: GET (limit/offset), GET /search, PATCH /{col}/{val}, PATCH /batch_update, POST."""
+
+    class Manejador(_Manejador):
+        backend = "sheetdb"
+
+        def _ruta(self):
+            url = urlparse(self.path)
+            partes = [unquote(p) for p in url.path.strip("/").split("/")]
+            params = {k: v[0] for k, v in parse_qs(url.query, keep_blank_values=True).items()}
+            return hojas.get(partes[0]), partes[1:], params
+
+        def do_GET(self):
+            hoja, resto, params = self._ruta()
+            if hoja is None:
+                return self._json(404, {"error": "not found"})
+            limite = int(params.pop("limit", 0) or 0)
+            desde = int(params.pop("offset", 0) or 0)
+            params.pop("casesensitive", None)
+            with hoja.lock:
+                if resto[:1] == ["search"]:
+                    self._esperar("search")
+                    filas = [dict(f) for f in hoja.filas if _coincide(f, params)]
+                else:
+                    self._esperar("get")
+                    filas = [dict(f) for f in hoja.filas]
+            filas = filas[desde:desde + limite] if limite else filas[desde:]
+            self._json(200, filas)
+
+        def do_PATCH(self):
+            hoja, resto, _ = self._ruta()
+            datos = json.loads(self._cuerpo() or b"{}").get("data")
+            actualizadas = 0
+            with hoja.lock:
+                if resto == ["batch_update"]:
+                    self._esperar("batch_update")
+                    for cambio in datos:
+                        cambio = dict(cambio)
+                        columna, valor = cambio.pop("query").split("=", 1)
+                        for fila in hoja.filas:
+                            if str(fila.get(columna)) == valor:
+                                fila.update(cambio)
+                                actualizadas += 1
+                else:
+                    self._esperar("patch")
+                    columna, valor = resto[0], resto[1]
+                    for fila in hoja.filas:
+                        if str(fila.get(columna)) == valor:
+                            fila.update(datos)
+                            actualizadas += 1
+            self._json(200, {"updated": actualizadas})
+
+        def do_POST(self):
+            hoja, _, _ = self._ruta()
+            datos = json.loads(self._cuerpo() or b"{}").get("data", [])
+            self._esperar("post")
+            with hoja.lock:
+                hoja.filas.extend(dict(d) for d in datos)
+            self._json(201, {"created": len(datos)})
+
+    Manejador.latencia = latencia
+    Manejador.registro = registro
+    return Manejador
+
+
+def manejador_twilio(latencia, registro):
+    """Twilio Messages stand-in."""
+
+    class Manejador(_Manejador):
+        backend = "twilio"
+
+        def do_POST(self):
+            self._cuerpo()
+            self._esperar("messages")
+            self._json(201, {"sid": f"SM{random.getrandbits(64):016x}", "status": "queued"})
+
+    Manejador.latencia = latencia
+    Manejador.registro = registro
+    return Manejador
+
+
+def manejador_openai(latencia, registro):
+    """Chat-completions stand-in: answers yes/no prompts with 'yes' and date prompts with tomorrow 10:00."""
+
+    class Manejador(_Manejador):
+        backend = "openai"
+
+        def do_POST(self):
+            peticion = json.loads(self._cuerpo() or b"{}")
+            modelo = peticion.get("model", "")
+            self._esperar(modelo)
+            sistema = peticion["messages"][0]["content"]
+            if "'yes' or 'no'" in sistema:
+                contenido = "yes"
+            else:
+                manana = (datetime.now() + timedelta(days=1)).strftime("%Y-%m-%d")
+                contenido = json.dumps({"fecha": manana, "hora": "10:00"})
+            self._json(200, {
+                "id": "chatcmpl-bench", "object": "chat.completion", "created": int(time.time()), "model": modelo,
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": contenido}}],
+                "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+            })
+
+    Manejador.latencia = latencia
+    Manejador.registro = registro
+    return Manejador
+
+
+def generar_datos(clientes, tecnicos, citas, semilla=7):
+    """Builds fake client, technician and appointment sheets."""
+    azar = random.Random(semilla)
+    filas_tecnicos = [{
+        "nombre_tecnicos": f"Tecnico {i}",
+        "horario_manana": "08:00 - 12:00",
+        "horario_tarde": "14:00 - 18:00",
+        "fecha_bloqueada": "",
+        "instalacion": "si",
+        "mantenimiento": "si" if i % 2 else "no",
+    } for i in range(tecnicos)]
+    filas_clientes = [{
+        "identificacion": str(100000 + i),
+        "telefono": f"+57300{i:07d}",
+        "nombre": f"Cliente {i}",
+        "tipo": "instalacion",
+        "servicio": "Instalación",
+        "direccion": f"Calle {i}",
+        "estado": "",
+        "contactado": "",
+    } for i in range(clientes)]
+    bloques = ["08:00 - 09:00", "09:00 - 10:00", "10:00 - 11:00", "11:00 - 12:00",
+               "14:00 - 15:00", "15:00 - 16:00", "16:00 - 17:00", "17:00 - 18:00"]
+    hoy = datetime.now().date()
+    filas_citas = [{
+        "telefono": "+570000000",
+        "nombre": "Histórico",
+        "tipo": "instalacion",
+        "servicio": "Instalación",
+        "nombre_tecnicos": f"Tecnico {azar.randrange(tecnicos)}",
+        "fechayhora": f"{hoy + timedelta(days=azar.randint(-60, 14))} {azar.choice(bloques)}",
+        "direccion": "",
+    } for _ in range(citas)]
+    return {
+        "clientes": HojaFalsa(filas_clientes),
+        "tecnicos": HojaFalsa(filas_tecnicos),
+        "citas": HojaFalsa(filas_citas),
+    }
+
+
+def iniciar_servidor(manejador):
+    servidor = _Servidor(("127.0.0.1", 0), manejador)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor, f"http://127.0.0.1:{servidor.server_address[1]}"
+
+
+def percentil(valores, p):
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    k = min(len(ordenados) - 1, max(0, int(round(p / 100 * (len(ordenados) - 1)))))
+    return ordenados[k]
+
+
+def resumen_latencias(latencias):
+    return {
+        "p50_ms": round(percentil(latencias, 50) * 1000, 2),
+        "p95_ms": round(percentil(latencias, 95) * 1000, 2),
+        "p99_ms": round(percentil(latencias, 99) * 1000, 2),
+    }
+
+
+# Each conversation: accept the template, turn down the offer, give a preference, accept it
+CONVERSACION = ["yes", "no, another day", "tomorrow at 10", "yes"]
+
+
+def preparar_conversaciones(hojas, conversaciones):
+    """Marks the first clients as contacted (before the app warms up) and returns their phones."""
+    with hojas["clientes"].lock:
+        elegidos = hojas["clientes"].filas[:conversaciones]
+        for fila in elegidos:
+            fila["estado"] = "esperando_confirmacion_agenda"
+        return [f["telefono"] for f in elegidos]
+
+
+def escenario_conversaciones(app, hojas, telefonos, concurrencia, al_terminar=None):
+    """Runs full confirm → propose → prefer → book conversations through /whatsapp."""
+    latencias = []
+    lock = threading.Lock()
+
+    def conversar(telefono):
+        cliente_http = app.test_client()
+        for mensaje in CONVERSACION:
+            inicio = time.perf_counter()
+            respuesta = cliente_http.post("/whatsapp", data={
+                "From": f"whatsapp:{telefono}", "Body": mensaje, "MessageSid": f"SM{random.getrandbits(128):032x}"
+            })
+            transcurrido = time.perf_counter() - inicio
+            assert respuesta.status_code == 200, respuesta.data
+            with lock:
+                latencias.append(transcurrido)
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrencia) as pool:
+        list(pool.map(conversar, telefonos))
+    duracion = time.perf_counter() - inicio
+    if al_terminar is not None:
+        al_terminar()  # e.g. push a local repository's bookings to the sheet
+
+    with hojas["citas"].lock:
+        agendadas = sum(1 for c in hojas["citas"].filas if c["telefono"] in set(telefonos))
+    return {
+        "mensajes": len(latencias),
+        "citas_agendadas": agendadas,
+        "mensajes_por_segundo": round(len(latencias) / duracion, 2) if duracion else 0.0,
+        **resumen_latencias(latencias),
+    }
+
+
+def escenario_campana(app, hojas, token):
+    """Triggers /iniciar-contacto and waits for the background campaign to finish."""
+    cliente_http = app.test_client()
+    with hojas["clientes"].lock:
+        for fila in hojas["clientes"].filas:
+            fila["contactado"] = ""
+        total = len(hojas["clientes"].filas)
+
+    inicio = time.perf_counter()
+    respuesta = cliente_http.get(f"/iniciar-contacto?token={token}")
+    latencia_disparo = time.perf_counter() - inicio
+    assert respuesta.status_code in (200, 202), respuesta.data
+    while True:
+        estado = cliente_http.get(f"/estado-contacto?token={token}").get_json()
+        if estado.get("estado") != "en_curso":
+            break
+        time.sleep(0.05)
+    duracion = time.perf_counter() - inicio
+    return {
+        "clientes": total,
+        "enviados": estado.get("enviados", 0),
+        "latencia_disparo_ms": round(latencia_disparo * 1000, 2),
+        "mensajes_por_segundo": round(estado.get("enviados", 0) / duracion, 2) if duracion else 0.0,
+    }
+
+
+def ejecutar(args):
+    registro = Registro()
+    hojas = generar_datos(args.clientes, args.tecnicos, args.citas)
+    _, url_sheetdb = iniciar_servidor(manejador_sheetdb(hojas, args.latencia_sheetdb / 1000, registro))
+    _, url_twilio = iniciar_servidor(manejador_twilio(args.latencia_twilio / 1000, registro))
+    _, url_openai = iniciar_servidor(manejador_openai(args.latencia_openai / 1000, registro))
+
+    temporal = tempfile.mkdtemp(prefix="bench_")
+    token = "bench-token"
+    os.environ.update({
+        "SHEETDB_CLIENTES": f"{url_sheetdb}/clientes",
+        "SHEETDB_TECNICOS": f"{url_sheetdb}/tecnicos",
+        "SHEETDB_CITAS": f"{url_sheetdb}/citas",
+        "TWILIO_API_BASE": url_twilio,
+        "TWILIO_ACCOUNT_SID": "ACbench",
+        "TWILIO_AUTH_TOKEN": "bench",
+        "TWILIO_WHATSAPP_NUMBER": "whatsapp:+10000000000",
+        "OPENAI_API_KEY": "bench",
+        "OPENAI_BASE_URL": f"{url_openai}/v1",
+        "SECRET_TRIGGER_TOKEN": token,
+        "SHEETDB_JOURNAL": os.path.join(temporal, "journal.jsonl"),
+        "CAMPANA_CHECKPOINT": os.path.join(temporal, "checkpoint.jsonl"),
+        "CAMPANA_MENSAJES_POR_SEGUNDO": str(args.ritmo_campana),
+        "REPOSITORIO_BACKEND": args.repositorio,
+        "REPOSITORIO_SQLITE_RUTA": os.path.join(temporal, "repositorio.db"),
+        "LLM_CACHE_RUTA": os.path.join(temporal, "llm_cache.db"),
+        "WEBHOOK_BLOQUEOS_RUTA": os.path.join(temporal, "bloqueos.lock"),
+    })
+    sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+    os.environ.setdefault("LOG_LEVEL", "DEBUG" if args.verboso else "WARNING")
+    salida = io.StringIO() if not args.verboso else sys.stdout
+    with contextlib.redirect_stdout(salida):
+        import index
+
+        telefonos = preparar_conversaciones(hojas, args.conversaciones)
+        app = index.crear_app()
+        registro.reiniciar()
+        conversaciones = escenario_conversaciones(
+            app, hojas, telefonos, args.concurrencia,
+            getattr(index.repositorio, "sincronizar", None)
+        )
+        if index.cola_escritura is not None:
+            index.cola_escritura.vaciar()
+        llamadas_conversacion = registro.por_backend()
+
+        registro.reiniciar()
+        campana = escenario_campana(app, hojas, token)
+        if index.cola_escritura is not None:
+            index.cola_escritura.vaciar()
+        llamadas_campana = registro.por_backend()
+
+    mensajes = max(1, conversaciones["mensajes"])
+    conversaciones["llamadas_por_mensaje"] = {
+        backend: round(n / mensajes, 3) for backend, n in sorted(llamadas_conversacion.items())
+    }
+    enviados = max(1, campana["enviados"])
+    campana["llamadas_por_cliente"] = {
+        backend: round(n / enviados, 3) for backend, n in sorted(llamadas_campana.items())
+    }
+    return {
+        "parametros": {
+            "clientes": args.clientes, "tecnicos": args.tecnicos, "citas": args.citas,
+            "conversaciones": args.conversaciones, "concurrencia": args.concurrencia,
+            "latencia_sheetdb_ms": args.latencia_sheetdb, "latencia_twilio_ms": args.latencia_twilio,
+            "latencia_openai_ms": args.latencia_openai, "repositorio": args.repositorio,
+        },
+        "conversaciones": conversaciones,
+        "campana": campana,
+    }
+
+
+def contrato(args):
+    """Runs repositorio.verificar_contrato against the SheetDB stand-in. Returns the mismatches."""
+    hojas = generar_datos(args.clientes, args.tecnicos, args.citas)
+    _, url_sheetdb = iniciar_servidor(manejador_sheetdb(hojas, 0, Registro()))
+    sys.path.insert(0, str(Path(__file__).resolve().parent))
+    from repositorio import RepositorioSheetDB, RepositorioSQLite, verificar_contrato
+    from transporte import Backend
+
+    hoja = RepositorioSheetDB(Backend("sheetdb"), f"{url_sheetdb}/clientes", f"{url_sheetdb}/tecnicos", f"{url_sheetdb}/citas")
+    with tempfile.TemporaryDirectory(prefix="bench_") as temporal:
+        return verificar_contrato(hoja, RepositorioSQLite(os.path.join(temporal, "repositorio.db")))
+
+
+def comparar(actual, base):
+    """Returns human-readable regressions of `actual` against `base`."""
+    regresiones = []
+    if actual["parametros"] != base["parametros"]:
+        regresiones.append("⚠️ parameters differ from the baseline; comparison is not meaningful")
+    a, b = actual["conversaciones"], base["conversaciones"]
+    for clave in ("p50_ms", "p95_ms", "p99_ms"):
+        if a[clave] > b[clave] * (1 + TOLERANCIA_LATENCIA):
+            regresiones.append(f"conversaciones.{clave}: {b[clave]} → {a[clave]}")
+    if a["mensajes_por_segundo"] < b["mensajes_por_segundo"] * (1 - TOLERANCIA_RITMO):
+        regresiones.append(f"conversaciones.mensajes_por_segundo: {b['mensajes_por_segundo']} → {a['mensajes_por_segundo']}")
+    for seccion, clave in (("conversaciones", "llamadas_por_mensaje"), ("campana", "llamadas_por_cliente")):
+        for backend, n in actual[seccion][clave].items():
+            previo = base[seccion][clave].get(backend, 0)
+            if n > previo * (1 + TOLERANCIA_LLAMADAS) + 1e-9:
+                regresiones.append(f"{seccion}.{clave}.{backend}: {previo} → {n}")
+    a, b = actual["campana"], base["campana"]
+    if a["mensajes_por_segundo"] < b["mensajes_por_segundo"] * (1 - TOLERANCIA_RITMO):
+        regresiones.append(f"campana.mensajes_por_segundo: {b['mensajes_por_segundo']} → {a['mensajes_por_segundo']}")
+    return regresiones
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clientes", type=int, default=500)
+    parser.add_argument("--tecnicos", type=int, default=8)
+    parser.add_argument("--citas", type=int, default=2000)
+    parser.add_argument("--conversaciones", type=int, default=40)
+    parser.add_argument("--concurrencia", type=int, default=4)
+    parser.add_argument("--latencia-sheetdb", type=float, default=20, help="ms per SheetDB request")
+    parser.add_argument("--latencia-twilio", type=float, default=30, help="ms per Twilio request")
+    parser.add_argument("--latencia-openai", type=float, default=150, help="ms per chat completion")
+    parser.add_argument("--ritmo-campana", type=float, default=100, help="campaign rate limit, messages/s")
+    parser.add_argument("--repositorio", choices=("sheetdb", "sqlite"), default="sheetdb",
+                        help="storage backend the app runs on (REPOSITORIO_BACKEND)")
+    parser.add_argument("--guardar-base", action="store_true", help="save this run as the baseline")
+    parser.add_argument("--comparar", action="store_true", help="exit 1 on regressions vs the baseline")
+    parser.add_argument("--base", default=str(RUTA_BASE))
+    parser.add_argument("--verboso", action="store_true", help="show the app's own output")
+    parser.add_argument("--contrato", action="store_true", help="only check both repository backends agree")
+    args = parser.parse_args()
+
+    if args.contrato:
+        errores = contrato(args)
+        for metodo, argumentos, esperado, obtenido in errores:
+            print(f"❌ {metodo}{argumentos}: SheetDB returned {len(esperado)} rows, SQLite {len(obtenido)}")
+        print(f"{'✅' if not errores else '❌'} {len(errores)} mismatches")
+        sys.exit(1 if errores else 0)
+
+    resultado = ejecutar(args)
+    print(json.dumps(resultado, indent=2, ensure_ascii=False))
+
+    if args.guardar_base:
+        with open(args.base, "w", encoding="utf-8") as f:
+            json.dump(resultado, f, indent=2, ensure_ascii=False)
+            f.write("\n")
+        print(f"💾 Baseline saved to {args.base}")
+
+    if args.comparar:
+        with open(args.base, encoding="utf-8") as f:
+            base = json.load(f)
+        regresiones = comparar(resultado, base)
+        for r in regresiones:
+            print(f"❌ {r}")
+        if regresiones:
+            sys.exit(1)
+        print("✅ No regressions against the baseline")
+
+
+if __name__ == "__main__":
+    main()
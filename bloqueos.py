@@ -0,0 +1,43 @@
+import fcntl
+import os
+import threading
+import zlib
+from contextlib import contextmanager
+
+
+class BloqueoPorClave:
+    """Serializes work per key (a phone number) across threads and worker processes.
+
+    Keys hash to one of `franjas` stripes. Inside a process a stripe is a threading.Lock;
+    between processes it is a one-byte lockf range of a shared file, which the kernel
+    releases if the worker dies, so a crash never leaves a number locked.
+    """
+
+    def __init__(self, ruta, franjas=256):
+        self.ruta = os.fspath(ruta)
+        self.franjas = franjas
+        self._lock = threading.Lock()
+        self._pid = None
+        self._fd = None
+        self._locks = []
+
+    def _preparar(self):
+        # Record locks belong to the process, so each forked worker opens its own descriptor
+        with self._lock:
+            if self._pid != os.getpid():
+                self._fd = os.open(self.ruta, os.O_RDWR | os.O_CREAT, 0o644)
+                self._locks = [threading.Lock() for _ in range(self.franjas)]
+                self._pid = os.getpid()
+            return self._fd, self._locks
+
+    @contextmanager
+    def bloqueo(self, clave):
+        """Holds the key's stripe for the duration of the `with` block."""
+        fd, locks = self._preparar()
+        franja = zlib.crc32(str(clave).encode()) % self.franjas
+        with locks[franja]:
+            fcntl.lockf(fd, fcntl.LOCK_EX, 1, franja)
+            try:
+                yield
+            finally:
+                fcntl.lockf(fd, fcntl.LOCK_UN, 1, franja)
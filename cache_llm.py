@@ -0,0 +1,114 @@
+import hashlib
+import os
+import sys
+import time
+import unicodedata
+
+from metricas import registro
+from sqlite_compartido import ConexionesWAL, Depuracion
+
+
+class CacheLLM:
+    """Persistent cache of model answers in a SQLite file (WAL) shared by every worker on the host.
+
+    Only deterministic calls (temperature 0) belong here. The key is the model, the
+    message text (casefolded, NFC, whitespace collapsed) and any other input the prompt depends on (`contexto`,
+    e.g. the reference date of a date question), so the same reply from many
+    customers costs one call. Entries expire after `ttl` and the least recently
+    used ones are evicted beyond `max_entradas`.
+    """
+
+    def __init__(self, ruta, max_entradas=50000, ttl=30 * 86400, intervalo_limpieza=60):
+        self.ruta = os.fspath(ruta)
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self._conexion = ConexionesWAL(self.ruta)
+        self._depuracion = Depuracion("respuestas", max_entradas, intervalo_limpieza)
+        self.aciertos = 0
+        self.fallos = 0
+        self.expulsiones = 0
+        with self._conexion() as con:
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS respuestas ("
+                " clave TEXT PRIMARY KEY, modelo TEXT NOT NULL, respuesta TEXT NOT NULL,"
+                " expira REAL NOT NULL, usado REAL NOT NULL)"
+            )
+            con.execute("CREATE INDEX IF NOT EXISTS respuestas_usado ON respuestas (usado)")
+
+    @staticmethod
+    def normalizar(texto):
+        """Case- and spacing-insensitive form that keeps every symbol ("👍" and "👎", "sí" and "¿sí?" stay apart)."""
+        return " ".join(unicodedata.normalize("NFC", texto or "").casefold().split())
+
+    @classmethod
+    def clave(cls, modelo, texto, contexto=""):
+        normalizado = cls.normalizar(texto)
+        return hashlib.sha256(f"{modelo}\x00{contexto}\x00{normalizado}".encode()).hexdigest()
+
+    def obtener(self, modelo, texto, contexto=""):
+        """Returns the cached answer or None."""
+        con = self._conexion()
+        clave = self.clave(modelo, texto, contexto)
+        fila = con.execute("SELECT respuesta, expira, usado FROM respuestas WHERE clave = ?", (clave,)).fetchone()
+        ahora = time.time()
+        if fila is None or fila[1] < ahora:
+            self.fallos += 1
+            registro.incrementar("cache_llm_total", modelo=modelo, resultado="fallo")
+            return None
+        # Recency for LRU eviction, refreshed at most hourly so hits stay read-only
+        if ahora - fila[2] > 3600:
+            con.execute("UPDATE respuestas SET usado = ? WHERE clave = ?", (ahora, clave))
+        self.aciertos += 1
+        registro.incrementar("cache_llm_total", modelo=modelo, resultado="acierto")
+        return fila[0]
+
+    def guardar(self, modelo, texto, respuesta, contexto=""):
+        con = self._conexion()
+        ahora = time.time()
+        con.execute(
+            "INSERT OR REPLACE INTO respuestas (clave, modelo, respuesta, expira, usado) VALUES (?, ?, ?, ?, ?)",
+            (self.clave(modelo, texto, contexto), modelo, respuesta, ahora + self.ttl, ahora)
+        )
+        self.expulsiones += sum(self._depuracion(con))
+
+    def resolver(self, modelo, texto, calcular, contexto=""):
+        """Returns the cached answer, or calls `calcular()` and caches what it returns."""
+        respuesta = self.obtener(modelo, texto, contexto)
+        if respuesta is None:
+            respuesta = calcular()
+            self.guardar(modelo, texto, respuesta, contexto)
+        return respuesta
+
+    def metricas(self):
+        entradas = self._conexion().execute("SELECT COUNT(*) FROM respuestas").fetchone()[0]
+        consultas = self.aciertos + self.fallos
+        return {
+            "entradas": entradas,
+            "aciertos": self.aciertos,
+            "fallos": self.fallos,
+            "tasa_aciertos": round(self.aciertos / consultas, 3) if consultas else 0.0,
+            "expulsiones": self.expulsiones,
+        }
+
+
+def crear_cache_llm():
+    """Builds the LLM cache unless LLM_CACHE=0."""
+    if os.getenv("LLM_CACHE", "1") == "0":
+        return None
+    ruta = os.getenv("LLM_CACHE_RUTA", os.path.join(os.path.dirname(os.path.abspath(__file__)), "llm_cache.db"))
+    return CacheLLM(
+        ruta,
+        max_entradas=int(os.getenv("LLM_CACHE_MAX_ENTRADAS", "50000")),
+        ttl=int(os.getenv("LLM_CACHE_TTL", str(30 * 86400)))
+    )
+
+
+if __name__ == "__main__":
+    # Warm-up from past traffic, one customer message per line:
+    #   python cache_llm.py historial.txt
+    # Date answers depend on today's date, so run it at the start of the day.
+    import index
+
+    with open(sys.argv[1], encoding="utf-8") if len(sys.argv) > 1 else sys.stdin as f:
+        mensajes = [linea.strip() for linea in f if linea.strip()]
+    print(f"🔥 Warmed {index.calentar_cache_llm(mensajes)} messages; cache: {index.cache_llm.metricas()}")
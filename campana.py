@@ -0,0 +1,189 @@
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Token-bucket rate limiter: `tasa` tokens per second, bursts of up to `capacidad`."""
+
+    def __init__(self, tasa, capacidad=None):
+        self.tasa = float(tasa)
+        self.capacidad = float(capacidad if capacidad is not None else max(1.0, tasa))
+        self._tokens = self.capacidad
+        self._ultimo = time.monotonic()
+        self._lock = threading.Lock()
+
+    def tomar(self):
+        """Blocks until one token is available and consumes it."""
+        while True:
+            with self._lock:
+                ahora = time.monotonic()
+                self._tokens = min(self.capacidad, self._tokens + (ahora - self._ultimo) * self.tasa)
+                self._ultimo = ahora
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                espera = (1 - self._tokens) / self.tasa
+            time.sleep(espera)
+
+
+class Campana:
+    """Background outbound campaign with a rate limit, bounded concurrency and a resume checkpoint.
+
+    A flock on `<checkpoint>.lock` makes it one campaign per host, whichever worker
+    receives the trigger.
+    """
+
+    def __init__(self, contactar, checkpoint, tasa=10, concurrencia=8, pendiente=None, espera_confirmacion=60.0):
+        # `contactar(cliente)` sends the message and updates the sheet; returns True on success.
+        # `pendiente(identificacion)` is True while that client's sheet update is still queued:
+        # the checkpoint is kept until every update of the run is confirmed (or `espera_confirmacion` runs out)
+        self._contactar = contactar
+        self.checkpoint = os.fspath(checkpoint)
+        self.tasa = tasa
+        self.concurrencia = concurrencia
+        self._pendiente = pendiente
+        self.espera_confirmacion = espera_confirmacion
+        self._lock = threading.Lock()
+        self._hilo = None
+        self._estado = {"estado": "inactiva"}
+
+    def _leer_checkpoint(self):
+        """Returns the identifications already messaged by an interrupted run."""
+        hechos = set()
+        if os.path.exists(self.checkpoint):
+            with open(self.checkpoint, encoding="utf-8") as f:
+                for linea in f:
+                    linea = linea.strip()
+                    if linea:
+                        hechos.add(json.loads(linea)["identificacion"])
+        return hechos
+
+    def _tomar_candado(self):
+        """Exclusive lock for the whole run, or None if another process is running a campaign."""
+        candado = open(self.checkpoint + ".lock", "a")
+        try:
+            fcntl.flock(candado, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            candado.close()
+            return None
+        return candado
+
+    def _marcar(self, identificacion):
+        """Durably records that a client has been messaged."""
+        with self._lock:
+            with open(self.checkpoint, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"identificacion": identificacion}) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def en_curso(self):
+        return self._hilo is not None and self._hilo.is_alive()
+
+    def iniciar(self, clientes):
+        """Starts the campaign in a background thread. Returns False if one is already running."""
+        with self._lock:
+            if self.en_curso():
+                return False
+            candado = self._tomar_candado()
+            if candado is None:
+                return False
+            self._estado = {
+                "estado": "en_curso",
+                "inicio": time.time(),
+                "fin": None,
+                "procesados": 0,
+                "enviados": 0,
+                "fallidos": 0,
+                "omitidos": 0,
+            }
+            self._enviados = []
+            self._hilo = threading.Thread(target=self._ejecutar, args=(clientes, candado), daemon=True)
+            self._hilo.start()
+        return True
+
+    def _sumar(self, campo):
+        with self._lock:
+            self._estado[campo] += 1
+
+    def _procesar(self, cliente, limite, cupos):
+        try:
+            limite.tomar()
+            if self._contactar(cliente):
+                self._marcar(cliente["identificacion"])
+                with self._lock:
+                    self._enviados.append(cliente["identificacion"])
+                self._sumar("enviados")
+            else:
+                self._sumar("fallidos")
+        except Exception as e:
+            log.error("Error contacting client: %s", e, extra={"identificacion": cliente.get("identificacion")})
+            self._sumar("fallidos")
+        finally:
+            self._sumar("procesados")
+            cupos.release()
+
+    def _ejecutar(self, clientes, candado):
+        try:
+            self._recorrer(clientes)
+        finally:
+            candado.close()
+
+    def _confirmados(self):
+        """Waits for the queued sheet updates of this run. Returns False if some are still pending."""
+        if self._pendiente is None:
+            return True
+        limite = time.monotonic() + self.espera_confirmacion
+        restantes = list(self._enviados)
+        while True:
+            restantes = [i for i in restantes if self._pendiente(i)]
+            if not restantes or time.monotonic() >= limite:
+                return not restantes
+            time.sleep(0.5)
+
+    def _recorrer(self, clientes):
+        hechos = self._leer_checkpoint()
+        limite = TokenBucket(self.tasa)
+        # Bounds queued work so large client lists are not all submitted at once
+        cupos = threading.Semaphore(self.concurrencia * 2)
+        try:
+            with ThreadPoolExecutor(max_workers=self.concurrencia) as pool:
+                for cliente in clientes:
+                    if cliente.get("identificacion") in hechos:
+                        self._sumar("omitidos")
+                        continue
+                    cupos.acquire()
+                    pool.submit(self._procesar, cliente, limite, cupos)
+        except Exception as e:
+            log.exception("Campaign interrupted: %s", e)
+            with self._lock:
+                self._estado["estado"] = "interrumpida"
+                self._estado["fin"] = time.time()
+            return
+
+        confirmados = self._confirmados()
+        with self._lock:
+            self._estado["estado"] = "completada"
+            self._estado["fin"] = time.time()
+            # A clean run leaves nothing to resume; failed sends and unconfirmed "contactado"
+            # updates keep the checkpoint, so the next run does not message those clients again
+            if self._estado["fallidos"] == 0 and confirmados and os.path.exists(self.checkpoint):
+                os.remove(self.checkpoint)
+
+    def estado(self):
+        """Returns progress and throughput of the current or last run."""
+        with self._lock:
+            estado = dict(self._estado)
+        if "inicio" in estado:
+            duracion = (estado["fin"] or time.time()) - estado["inicio"]
+            estado["duracion_segundos"] = round(duracion, 3)
+            estado["mensajes_por_segundo"] = round(estado["enviados"] / duracion, 3) if duracion > 0 else 0.0
+        estado["tasa_limite"] = self.tasa
+        estado["concurrencia"] = self.concurrencia
+        return estado
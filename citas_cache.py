@@ -0,0 +1,142 @@
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+class IndiceCitas:
+    """In-process index of booked appointment blocks keyed by (technician, date)."""
+
+    def __init__(self, cargar, ttl=60):
+        # `cargar` returns every appointment row (dicts with nombre_tecnicos / fechayhora)
+        self._cargar = cargar
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._lock_recarga = threading.Lock()
+        self._por_clave = {}
+        self._por_tecnico = {}  # technician -> {date: booked blocks}, the load counter
+        self._cargado_en = None
+        self._escrituras_recientes = []
+        self.aciertos = 0
+        self.fallos = 0
+        self.recargas = 0
+        self.escrituras_locales = 0
+
+    @staticmethod
+    def _clave_de(cita):
+        """Splits an appointment row into ((technician, date), block)."""
+        fechayhora = cita.get("fechayhora", "")
+        if " " not in fechayhora:
+            return None, None
+        fecha, bloque = fechayhora.split(" ", 1)
+        return (cita.get("nombre_tecnicos", ""), fecha), bloque
+
+    def _construir(self, citas):
+        """Builds a fresh (technician, date) -> set(blocks) mapping."""
+        por_clave = {}
+        for cita in citas:
+            clave, bloque = self._clave_de(cita)
+            if clave is not None:
+                por_clave.setdefault(clave, set()).add(bloque)
+        return por_clave
+
+    def _vigente(self):
+        return self._cargado_en is not None and time.monotonic() - self._cargado_en < self.ttl
+
+    def refrescar(self, forzar=False):
+        """Reloads the whole appointments table in bulk when the TTL has expired."""
+        if not forzar and self._vigente():
+            return False
+        # Only one thread downloads the sheet; the others wait and reuse its result
+        with self._lock_recarga:
+            if not forzar and self._vigente():
+                return False
+            inicio = time.monotonic()
+            por_clave = self._construir(self._cargar())
+            with self._lock:
+                # Local writes may not be visible in the sheet yet; keep them on top of the reload
+                self._escrituras_recientes = [
+                    (momento, cita) for momento, cita in self._escrituras_recientes
+                    if momento >= inicio - self.ttl
+                ]
+                for _, cita in self._escrituras_recientes:
+                    clave, bloque = self._clave_de(cita)
+                    por_clave.setdefault(clave, set()).add(bloque)
+                self._por_clave = por_clave
+                self._por_tecnico = por_tecnico = {}
+                for (tecnico, fecha), bloques in por_clave.items():
+                    por_tecnico.setdefault(tecnico, {})[fecha] = len(bloques)
+                self._cargado_en = time.monotonic()
+                self.recargas += 1
+        return True
+
+    def refrescar_en_segundo_plano(self):
+        """Starts a reload without blocking the caller; the current map keeps serving meanwhile."""
+        if self._vigente() or self._lock_recarga.locked():
+            return
+        threading.Thread(target=self._refrescar_seguro, daemon=True).start()
+
+    def _refrescar_seguro(self):
+        try:
+            self.refrescar()
+        except Exception as e:
+            log.warning("Appointment index refresh failed: %s", e)
+
+    def _asegurar(self):
+        """Blocks only on the first load; afterwards a stale map answers while it reloads. True if stale."""
+        if self._cargado_en is None:
+            return self.refrescar()
+        if self._vigente():
+            return False
+        self.refrescar_en_segundo_plano()
+        return True
+
+    def bloques(self, tecnico, fecha):
+        """Returns the set of booked blocks for a technician on a date (YYYY-MM-DD)."""
+        if self._asegurar():
+            self.fallos += 1
+        else:
+            self.aciertos += 1
+        with self._lock:
+            return set(self._por_clave.get((tecnico, fecha), ()))
+
+    def carga(self, tecnico, fechas):
+        """Number of blocks booked for a technician over the given dates (YYYY-MM-DD)."""
+        self._asegurar()
+        with self._lock:
+            por_fecha = self._por_tecnico.get(tecnico, {})
+            return sum(por_fecha.get(fecha, 0) for fecha in fechas)
+
+    def registrar(self, cita):
+        """Applies an appointment written by this process without waiting for a reload."""
+        clave, bloque = self._clave_de(cita)
+        if clave is None:
+            return
+        with self._lock:
+            bloques = self._por_clave.setdefault(clave, set())
+            if bloque not in bloques:
+                bloques.add(bloque)
+                tecnico, fecha = clave
+                por_fecha = self._por_tecnico.setdefault(tecnico, {})
+                por_fecha[fecha] = por_fecha.get(fecha, 0) + 1
+            self._escrituras_recientes.append((time.monotonic(), cita))
+            self.escrituras_locales += 1
+
+    def invalidar(self):
+        """Makes the next lookup start a reload (in the background once the table was loaded)."""
+        with self._lock:
+            if self._cargado_en is not None:
+                self._cargado_en = float("-inf")
+
+    def metricas(self):
+        """Returns hit/miss counters for diagnostics."""
+        with self._lock:
+            claves = len(self._por_clave)
+        return {
+            "aciertos": self.aciertos,
+            "fallos": self.fallos,
+            "recargas": self.recargas,
+            "escrituras_locales": self.escrituras_locales,
+            "claves": claves,
+        }
@@ -0,0 +1,212 @@
+import fcntl
+import glob
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+def _bloquear(ruta, esperar=True):
+    """Opens and flocks a lock file. Returns None if another live process holds it (and esperar=False)."""
+    while True:
+        candado = open(ruta, "a")
+        try:
+            fcntl.flock(candado, fcntl.LOCK_EX | (0 if esperar else fcntl.LOCK_NB))
+        except BlockingIOError:
+            candado.close()
+            return None
+        try:
+            if os.fstat(candado.fileno()).st_ino == os.stat(ruta).st_ino:
+                return candado
+        except FileNotFoundError:
+            pass
+        candado.close()  # Removed by a process adopting the journal meanwhile: lock the new file
+
+
+def _leer_journal(ruta):
+    """Yields (identificacion, campos) from a journal, skipping a torn last line."""
+    try:
+        with open(ruta, encoding="utf-8") as f:
+            for linea in f:
+                linea = linea.strip()
+                if not linea:
+                    continue
+                try:
+                    entrada = json.loads(linea)
+                except ValueError:
+                    continue  # Torn last line from a crash mid-write
+                yield entrada["identificacion"], entrada["campos"]
+    except FileNotFoundError:
+        return
+
+
+class ColaEscritura:
+    """Write-behind queue for client field updates, backed by a local durable journal.
+
+    Updates for the same `identificacion` are merged into one payload and flushed
+    in batches by a background thread; failed batches are retried with backoff.
+    Each process writes its own journal (`sheetdb_journal.<pid>.jsonl`), holding a
+    flock on `sheetdb_journal.<pid>.lock` while it lives; on first use a process
+    adopts the journals whose lock is free, i.e. those of processes that died.
+    """
+
+    def __init__(self, enviar_lote, journal, intervalo=1.0, tamano_lote=50, espera_maxima=60.0):
+        # `enviar_lote([(identificacion, campos), ...])` must raise if the batch was not applied
+        self._enviar_lote = enviar_lote
+        self.journal = os.fspath(journal)
+        self.intervalo = intervalo
+        self.tamano_lote = tamano_lote
+        self.espera_maxima = espera_maxima
+        self._lock = threading.Lock()
+        self._hay_datos = threading.Event()
+        self._pendientes = {}
+        self._en_vuelo = {}
+        self._hilo = None
+        self._hilo_pid = None
+        self._pid = None
+        self._ruta_journal = None
+        self._candado = None
+        self.encoladas = 0
+        self.enviadas = 0
+        self.lotes = 0
+        self.reintentos = 0
+
+    @staticmethod
+    def _ruta_candado(ruta_journal):
+        return os.path.splitext(ruta_journal)[0] + ".lock"
+
+    def _preparar_proceso(self):
+        """Opens this process's journal and adopts the ones left by dead processes. Caller holds the lock."""
+        if self._pid == os.getpid():
+            return
+        base, extension = os.path.splitext(self.journal)
+        self._ruta_journal = f"{base}.{os.getpid()}{extension}"
+        self._candado = _bloquear(self._ruta_candado(self._ruta_journal))
+        self._pid = os.getpid()
+
+        # A file with our own pid is from an earlier process that got the same pid (e.g. a restarted container)
+        for identificacion, campos in _leer_journal(self._ruta_journal):
+            self._pendientes.setdefault(identificacion, {}).update(campos)
+        adoptados = []
+        for ruta in sorted(set(glob.glob(f"{glob.escape(base)}.*{extension}")) | {self.journal}):
+            if ruta == self._ruta_journal or not os.path.exists(ruta):
+                continue
+            candado = _bloquear(self._ruta_candado(ruta), esperar=False)
+            if candado is None:
+                continue  # Its process is alive
+            for identificacion, campos in _leer_journal(ruta):
+                self._pendientes.setdefault(identificacion, {}).update(campos)
+            adoptados.append((ruta, candado))
+
+        self._reescribir_journal()
+        for ruta, candado in adoptados:
+            for archivo in (ruta, self._ruta_candado(ruta)):
+                try:
+                    os.remove(archivo)
+                except FileNotFoundError:
+                    pass
+            candado.close()
+        if self._pendientes:
+            log.info("Recovered pending SheetDB updates from journal",
+                     extra={"pendientes": len(self._pendientes), "journals": len(adoptados)})
+            self._asegurar_hilo()
+            self._hay_datos.set()
+
+    def _reescribir_journal(self):
+        """Compacts the journal to the updates still outstanding. Caller holds the lock."""
+        temporal = self._ruta_journal + ".tmp"
+        with open(temporal, "w", encoding="utf-8") as f:
+            for origen in (self._en_vuelo, self._pendientes):
+                for identificacion, campos in origen.items():
+                    f.write(json.dumps({"identificacion": identificacion, "campos": campos}, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporal, self._ruta_journal)
+
+    def _asegurar_hilo(self):
+        # Started lazily so a pre-forking server gets one flusher per worker, not a dead one from the master
+        if self._hilo is not None and self._hilo.is_alive() and self._hilo_pid == os.getpid():
+            return
+        self._hilo_pid = os.getpid()
+        self._hilo = threading.Thread(target=self._bucle, daemon=True)
+        self._hilo.start()
+
+    def encolar(self, identificacion, campos):
+        """Merges `campos` into the pending update for `identificacion` and journals it."""
+        with self._lock:
+            self._preparar_proceso()
+            with open(self._ruta_journal, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"identificacion": identificacion, "campos": campos}, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self._pendientes.setdefault(identificacion, {}).update(campos)
+            self.encoladas += 1
+            self._asegurar_hilo()
+        self._hay_datos.set()
+
+    def pendientes(self, identificacion):
+        """Returns the fields not yet written to SheetDB for `identificacion` (newest values win)."""
+        with self._lock:
+            self._preparar_proceso()
+            if self._pendientes:
+                self._asegurar_hilo()
+            campos = dict(self._en_vuelo.get(identificacion, {}))
+            campos.update(self._pendientes.get(identificacion, {}))
+        return campos
+
+    def vaciar(self):
+        """Flushes everything pending right now. Returns True if SheetDB accepted it all."""
+        with self._lock:
+            self._preparar_proceso()
+            if self._en_vuelo:
+                return False  # The background thread is mid-flush
+            self._en_vuelo, self._pendientes = self._pendientes, {}
+            lote = list(self._en_vuelo.items())
+        try:
+            for i in range(0, len(lote), self.tamano_lote):
+                self._enviar_lote(lote[i:i + self.tamano_lote])
+                self.lotes += 1
+        except Exception as e:
+            log.warning("SheetDB batch update failed, will retry: %s", e)
+            with self._lock:
+                # Put the batch back underneath anything enqueued meanwhile
+                for identificacion, campos in self._en_vuelo.items():
+                    self._pendientes[identificacion] = {**campos, **self._pendientes.get(identificacion, {})}
+                self._en_vuelo = {}
+            return False
+
+        with self._lock:
+            self.enviadas += len(lote)
+            self._en_vuelo = {}
+            self._reescribir_journal()
+        return True
+
+    def _bucle(self):
+        espera = self.intervalo
+        while True:
+            self._hay_datos.wait()
+            # Short pause so bursts of updates for the same client coalesce into one PATCH
+            time.sleep(self.intervalo)
+            self._hay_datos.clear()
+            if self.vaciar():
+                espera = self.intervalo
+                continue
+            self.reintentos += 1
+            espera = min(self.espera_maxima, espera * 2)
+            time.sleep(espera * random.uniform(0.5, 1.0))
+            self._hay_datos.set()
+
+    def metricas(self):
+        with self._lock:
+            en_cola = len(self._pendientes) + len(self._en_vuelo)
+        return {
+            "encoladas": self.encoladas,
+            "enviadas": self.enviadas,
+            "lotes": self.lotes,
+            "reintentos": self.reintentos,
+            "en_cola": en_cola,
+        }
@@ -0,0 +1,92 @@
+import heapq
+import itertools
+import logging
+import os
+import queue
+import threading
+import time
+import zlib
+
+log = logging.getLogger(__name__)
+
+
+class Despachador:
+    """Worker pool that processes jobs in the background, in arrival order per key.
+
+    Every key (a phone number) always lands on the same worker thread, so within
+    this process two messages from one customer are handled one after the other,
+    in arrival order. Other server processes are kept out by the caller's
+    cross-process lease (bloqueos.BloqueoPorClave).
+    """
+
+    def __init__(self, procesar, trabajadores=4, capacidad=1000):
+        # `procesar(*args)` runs on a worker thread; exceptions are logged and counted
+        self._procesar = procesar
+        self.trabajadores = trabajadores
+        self.capacidad = capacidad
+        self._lock = threading.Lock()
+        self._colas = []
+        self._hilos = []
+        self._pid = None
+        self.encolados = 0
+        self.procesados = 0
+        self.errores = 0
+        self.rechazados = 0
+        self._secuencia = itertools.count()
+
+    def _asegurar_hilos(self):
+        # Started lazily so each forked server worker runs its own pool
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._colas = [queue.Queue(maxsize=self.capacidad) for _ in range(self.trabajadores)]
+            self._hilos = [
+                threading.Thread(target=self._bucle, args=(cola,), daemon=True) for cola in self._colas
+            ]
+            for hilo in self._hilos:
+                hilo.start()
+
+    def encolar(self, clave, *args, retraso=0.0):
+        """Queues a job for `clave`, to run no sooner than `retraso` seconds from now.
+
+        Returns False if that worker's queue is full.
+        """
+        self._asegurar_hilos()
+        cola = self._colas[zlib.crc32(str(clave).encode()) % self.trabajadores]
+        try:
+            cola.put_nowait((time.monotonic() + retraso, next(self._secuencia), args))
+        except queue.Full:
+            self.rechazados += 1
+            return False
+        self.encolados += 1
+        return True
+
+    def _bucle(self, cola):
+        # Delayed jobs wait in a local heap ordered by due time, then arrival
+        diferidos = []
+        while True:
+            espera = max(0.0, diferidos[0][0] - time.monotonic()) if diferidos else None
+            try:
+                heapq.heappush(diferidos, cola.get(timeout=espera))
+                cola.task_done()
+            except queue.Empty:
+                pass
+            while diferidos and diferidos[0][0] <= time.monotonic():
+                _, _, args = heapq.heappop(diferidos)
+                try:
+                    self._procesar(*args)
+                    self.procesados += 1
+                except Exception as e:
+                    self.errores += 1
+                    log.exception("Error processing queued message: %s", e)
+
+    def metricas(self):
+        return {
+            "trabajadores": self.trabajadores,
+            "encolados": self.encolados,
+            "procesados": self.procesados,
+            "errores": self.errores,
+            "rechazados": self.rechazados,
+            "en_cola": sum(c.qsize() for c in self._colas),
+        }
@@ -0,0 +1,135 @@
+import logging
+from collections import namedtuple
+from datetime import datetime, timedelta
+from functools import lru_cache
+
+log = logging.getLogger(__name__)
+
+# Lunch break (example: 13:00-14:00); blocks starting at these times are masked out
+INICIOS_ALMUERZO = ("13:00",)
+
+# One schedule template: block labels in offer order, their start times,
+# the first position of each start time and a bitmask of offerable positions.
+Plantilla = namedtuple("Plantilla", ["bloques", "inicios", "posicion_por_inicio", "validos"])
+
+
+def normalizar_rango(rango):
+    """Normalizes a time range string."""
+    if not rango:
+        return ""
+    return rango.strip().replace("\u00a0", " ").replace("–", "-").replace("—", "-").replace("–", "-")
+
+
+@lru_cache(maxsize=512)
+def bloques_de_rango(rango):
+    """Parses a range once and returns its one-hour blocks with the lunch mask applied."""
+    try:
+        log.debug("Generating blocks for range %r", rango)
+        rango = normalizar_rango(rango)
+        if "-" not in rango:
+            raise ValueError("Range does not contain '-'")
+
+        partes = [p.strip() for p in rango.split("-")]
+        if len(partes) != 2:
+            raise ValueError("Malformed range")
+
+        inicio_str = partes[0]
+        fin_str = partes[1]
+
+        if ':' not in inicio_str:
+            inicio_str += ":00"
+        if ':' not in fin_str:
+            fin_str += ":00"
+
+        inicio = datetime.strptime(inicio_str, "%H:%M")
+        fin = datetime.strptime(fin_str, "%H:%M")
+    except Exception as e:
+        log.error("Error processing range %r: %s", rango, e)
+        return ()
+
+    # Full hourly grid for the range, then the lunch rule as a mask over it
+    rejilla = []
+    actual = inicio
+    while actual + timedelta(hours=1) <= fin:
+        rejilla.append((actual.strftime("%H:%M"), (actual + timedelta(hours=1)).strftime("%H:%M")))
+        actual += timedelta(hours=1)
+
+    almuerzo = 0
+    for i, (inicio_bloque, _) in enumerate(rejilla):
+        if inicio_bloque in INICIOS_ALMUERZO:
+            almuerzo |= 1 << i
+
+    bloques = tuple(f"{a} - {b}" for i, (a, b) in enumerate(rejilla) if not almuerzo >> i & 1)
+    log.debug("Blocks generated: %s", list(bloques))
+    return bloques
+
+
+@lru_cache(maxsize=512)
+def plantilla_de_horario(manana, tarde):
+    """Builds (and memoizes) the slot template for a morning/afternoon schedule pair."""
+    bloques = ()
+    if manana:
+        bloques += bloques_de_rango(manana)
+    if tarde:
+        bloques += bloques_de_rango(tarde)
+
+    inicios = tuple(b.split(" - ")[0].strip() for b in bloques)
+    posicion_por_inicio = {}
+    validos = 0
+    vistos = set()
+    for i, bloque in enumerate(bloques):
+        posicion_por_inicio.setdefault(inicios[i], i)
+        # A repeated label can never be offered before its first occurrence, so only that one counts
+        if bloque not in vistos:
+            vistos.add(bloque)
+            validos |= 1 << i
+    return Plantilla(bloques, inicios, posicion_por_inicio, validos)
+
+
+def plantilla_de_tecnico(tecnico):
+    """Returns the memoized slot template for a technician row."""
+    return plantilla_de_horario(
+        (tecnico.get("horario_manana") or "").strip(),
+        (tecnico.get("horario_tarde") or "").strip()
+    )
+
+
+def mascara_libre(plantilla, agendados):
+    """Bitmask of the template's free positions given a set of booked block labels."""
+    ocupados = 0
+    if agendados:
+        for i, bloque in enumerate(plantilla.bloques):
+            if bloque in agendados:
+                ocupados |= 1 << i
+    return plantilla.validos & ~ocupados
+
+
+def primer_bloque_libre(plantilla, agendados):
+    """Returns the first free block in template order, or None."""
+    libres = mascara_libre(plantilla, agendados)
+    if not libres:
+        return None
+    return plantilla.bloques[(libres & -libres).bit_length() - 1]
+
+
+def bloque_mas_cercano(plantilla, agendados, hora):
+    """Returns the free block closest to the one starting at `hora` (ties go to the earlier block).
+
+    Returns None when no block starts at `hora` or nothing is free.
+    """
+    idx = plantilla.posicion_por_inicio.get(hora)
+    if idx is None:
+        return None
+    libres = mascara_libre(plantilla, agendados)
+    if not libres:
+        return None
+
+    # Highest free position <= idx and lowest free position >= idx, found with bit operations
+    abajo = libres & ((1 << (idx + 1)) - 1)
+    arriba = libres >> idx
+    bajo = abajo.bit_length() - 1 if abajo else None
+    alto = idx + (arriba & -arriba).bit_length() - 1 if arriba else None
+
+    if alto is None or (bajo is not None and idx - bajo <= alto - idx):
+        return plantilla.bloques[bajo]
+    return plantilla.bloques[alto]
@@ -0,0 +1,167 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from sqlite_compartido import ConexionesWAL, Depuracion
+
+
+class AlmacenMemoria:
+    """In-process conversation state with LRU + TTL eviction. Not shared between workers."""
+
+    def __init__(self, max_entradas=10000, ttl=86400, max_historial=10):
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self.max_historial = max_historial
+        self._lock = threading.RLock()
+        self._datos = OrderedDict()  # (espacio, clave) -> (expira, valor)
+        self.expulsiones_lru = 0
+        self.expulsiones_ttl = 0
+
+    def _leer(self, llave):
+        entrada = self._datos.get(llave)
+        if entrada is None:
+            return None
+        expira, valor = entrada
+        if expira < time.monotonic():
+            del self._datos[llave]
+            self.expulsiones_ttl += 1
+            return None
+        self._datos.move_to_end(llave)
+        return valor
+
+    def _escribir(self, llave, valor):
+        if valor is None:
+            self._datos.pop(llave, None)
+            return
+        self._datos[llave] = (time.monotonic() + self.ttl, valor)
+        self._datos.move_to_end(llave)
+        while len(self._datos) > self.max_entradas:
+            self._datos.popitem(last=False)
+            self.expulsiones_lru += 1
+
+    def obtener(self, espacio, clave, defecto=None):
+        with self._lock:
+            valor = self._leer((espacio, clave))
+        return defecto if valor is None else valor
+
+    def guardar(self, espacio, clave, valor):
+        with self._lock:
+            self._escribir((espacio, clave), valor)
+
+    def borrar(self, espacio, clave):
+        with self._lock:
+            self._datos.pop((espacio, clave), None)
+
+    def actualizar(self, espacio, clave, funcion):
+        """Atomically replaces the value with funcion(current value or None); None deletes it."""
+        with self._lock:
+            nuevo = funcion(self._leer((espacio, clave)))
+            self._escribir((espacio, clave), nuevo)
+            return nuevo
+
+    def agregar_historial(self, clave, mensaje):
+        """Appends a message to the bounded history and returns the history as one string."""
+        mensajes = self.actualizar("historial", clave, lambda h: ((h or []) + [mensaje])[-self.max_historial:])
+        return " ".join(mensajes).strip()
+
+    def metricas(self):
+        with self._lock:
+            entradas = len(self._datos)
+        return {
+            "backend": "memoria",
+            "entradas": entradas,
+            "expulsiones_lru": self.expulsiones_lru,
+            "expulsiones_ttl": self.expulsiones_ttl,
+        }
+
+
+class AlmacenSQLite(AlmacenMemoria):
+    """Conversation state in a SQLite file (WAL) shared by every worker process on the host."""
+
+    def __init__(self, ruta, max_entradas=100000, ttl=86400, max_historial=10, intervalo_limpieza=60, tabla="estado"):
+        super().__init__(max_entradas, ttl, max_historial)
+        self.ruta = os.fspath(ruta)
+        self.tabla = tabla  # Stores with their own TTL and cap share the file in separate tables
+        self._conexion = ConexionesWAL(self.ruta)
+        self._depuracion = Depuracion(tabla, max_entradas, intervalo_limpieza)
+        with self._conexion() as con:
+            con.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.tabla} ("
+                " espacio TEXT NOT NULL, clave TEXT NOT NULL, valor TEXT NOT NULL,"
+                " expira REAL NOT NULL, usado REAL NOT NULL, PRIMARY KEY (espacio, clave))"
+            )
+            con.execute(f"CREATE INDEX IF NOT EXISTS {self.tabla}_usado ON {self.tabla} (usado)")
+
+    def _limpiar(self, con):
+        """Drops expired rows and trims to max_entradas, least recently written first."""
+        vencidas, recortadas = self._depuracion(con)
+        self.expulsiones_ttl += vencidas
+        self.expulsiones_lru += recortadas
+
+    def _leer_en(self, con, espacio, clave):
+        fila = con.execute(
+            f"SELECT valor, expira FROM {self.tabla} WHERE espacio = ? AND clave = ?", (espacio, clave)
+        ).fetchone()
+        if fila is None or fila[1] < time.time():
+            return None
+        return json.loads(fila[0])
+
+    def _escribir_en(self, con, espacio, clave, valor):
+        if valor is None:
+            con.execute(f"DELETE FROM {self.tabla} WHERE espacio = ? AND clave = ?", (espacio, clave))
+            return
+        ahora = time.time()
+        con.execute(
+            f"INSERT OR REPLACE INTO {self.tabla} (espacio, clave, valor, expira, usado) VALUES (?, ?, ?, ?, ?)",
+            (espacio, clave, json.dumps(valor, ensure_ascii=False), ahora + self.ttl, ahora)
+        )
+
+    def obtener(self, espacio, clave, defecto=None):
+        valor = self._leer_en(self._conexion(), espacio, clave)
+        return defecto if valor is None else valor
+
+    def guardar(self, espacio, clave, valor):
+        con = self._conexion()
+        self._escribir_en(con, espacio, clave, valor)
+        self._limpiar(con)
+
+    def borrar(self, espacio, clave):
+        self._escribir_en(self._conexion(), espacio, clave, None)
+
+    def actualizar(self, espacio, clave, funcion):
+        """Atomically replaces the value across processes (BEGIN IMMEDIATE holds the write lock)."""
+        con = self._conexion()
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            nuevo = funcion(self._leer_en(con, espacio, clave))
+            self._escribir_en(con, espacio, clave, nuevo)
+            con.execute("COMMIT")
+        except BaseException:
+            con.execute("ROLLBACK")
+            raise
+        self._limpiar(con)
+        return nuevo
+
+    def metricas(self):
+        entradas = self._conexion().execute(f"SELECT COUNT(*) FROM {self.tabla}").fetchone()[0]
+        return {
+            "backend": "sqlite",
+            "entradas": entradas,
+            "expulsiones_lru": self.expulsiones_lru,
+            "expulsiones_ttl": self.expulsiones_ttl,
+        }
+
+
+def crear_almacen(tabla="estado", ttl=None, max_entradas=None):
+    """Builds the state store selected by ESTADO_BACKEND (memoria | sqlite).
+
+    Other `tabla` values give a separate store (own TTL and cap) in the same backend.
+    """
+    ttl = ttl or int(os.getenv("ESTADO_TTL", "86400"))
+    max_historial = int(os.getenv("ESTADO_MAX_HISTORIAL", "10"))
+    if os.getenv("ESTADO_BACKEND", "memoria") == "sqlite":
+        ruta = os.getenv("ESTADO_SQLITE_RUTA", os.path.join(os.path.dirname(os.path.abspath(__file__)), "estado_conversacion.db"))
+        return AlmacenSQLite(ruta, max_entradas=max_entradas or 100000, ttl=ttl, max_historial=max_historial, tabla=tabla)
+    return AlmacenMemoria(max_entradas or int(os.getenv("ESTADO_MAX_ENTRADAS", "10000")), ttl=ttl, max_historial=max_historial)
@@ -0,0 +1,238 @@
+import json
+import re
+import sys
+import unicodedata
+from datetime import datetime, timedelta
+from pathlib import Path
+
+# Default hour for a day period mentioned without an explicit time
+HORA_MANANA = 9
+HORA_TARDE = 15
+HORA_MEDIODIA = 12
+
+MESES = {
+    "january": 1, "february": 2, "march": 3, "april": 4, "may": 5, "june": 6,
+    "july": 7, "august": 8, "september": 9, "october": 10, "november": 11, "december": 12,
+    "enero": 1, "febrero": 2, "marzo": 3, "abril": 4, "mayo": 5, "junio": 6,
+    "julio": 7, "agosto": 8, "septiembre": 9, "setiembre": 9, "octubre": 10,
+    "noviembre": 11, "diciembre": 12,
+}
+
+DIAS_SEMANA = {
+    "monday": 0, "tuesday": 1, "wednesday": 2, "thursday": 3, "friday": 4, "saturday": 5, "sunday": 6,
+    "lunes": 0, "martes": 1, "miercoles": 2, "jueves": 3, "viernes": 4, "sabado": 5, "domingo": 6,
+}
+
+# Words that carry no date/time meaning; anything else left over makes the parse not confident
+RELLENO = {
+    "at", "the", "on", "a", "an", "in", "for", "around", "about", "like", "approximately",
+    "please", "pls", "ok", "okay", "yes", "yeah", "sure", "i", "can", "could", "would", "be",
+    "better", "maybe", "how", "what", "works", "work", "me", "is", "it", "this", "next", "coming",
+    "lets", "let", "say", "of", "prefer", "want", "to", "do", "you", "thanks", "thank", "hi", "hello",
+    "el", "la", "las", "los", "al", "de", "del", "en", "por", "para", "mejor", "puedo", "podria",
+    "puede", "ser", "si", "vale", "dale", "que", "tal", "sirve", "queda", "gracias", "porfa",
+    "favor", "este", "esta", "proximo", "proxima", "y", "tipo", "como", "eso", "sobre", "hacia",
+    "hola", "buenas", "dia", "prefiero", "quiero", "seria", "mas", "o", "menos", "eh",
+}
+
+# "around 4" / "tipo 4": an approximate hour, read as afternoon when it is 1-7
+_HORA_APROXIMADA = (
+    r"\b(?:around|about|like|approximately|tipo|como\s+a\s+las|a\s+eso\s+de\s+las|eso\s+de\s+las"
+    r"|sobre\s+las|hacia\s+las|tipo\s+las)\s+(\d{1,2})(?:\s*(?:h|hs|horas|o\s+clock))?\b"
+)
+_HORA_PREFIJADA = (
+    r"\b(?:at|by|a\s+las|a\s+la|las|la)\s+(\d{1,2})(?:\s*(?:h|hs|horas|o\s+clock))?\b"
+)
+
+
+def _normalizar(texto):
+    """Lowercases, strips accents and punctuation, and joins 'a.m.'-style suffixes."""
+    texto = unicodedata.normalize("NFKD", texto.lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    texto = re.sub(r"(\d)\s*([ap])\.?\s?m\b\.?", r"\1 \2m", texto)
+    texto = re.sub(r"[^\w: -]", " ", texto)
+    return " ".join(texto.split())
+
+
+class _Lectura:
+    """Date/time fields collected while consuming the message."""
+
+    def __init__(self):
+        self.fechas = set()
+        self.horas = set()
+        self.periodos = set()
+        self.aproximada = False
+
+
+def _siguiente_dia_semana(hoy, dia):
+    """Returns the next date with weekday `dia`, or None when it's today (ambiguous: today or next week)."""
+    delta = (dia - hoy.weekday()) % 7
+    if delta == 0:
+        return None
+    return hoy + timedelta(days=delta)
+
+
+def _fecha_con_mes(hoy, dia, mes):
+    """Builds a date in the current year; past dates are left to the LLM."""
+    try:
+        fecha = hoy.replace(month=mes, day=dia)
+    except ValueError:
+        return None
+    return fecha if fecha >= hoy else None
+
+
+def _reglas(hoy):
+    """(pattern, handler) pairs applied in order; each handler records what its match means."""
+    meses = "|".join(MESES)
+    dias = "|".join(DIAS_SEMANA)
+
+    def fecha(valor):
+        def manejar(m, lectura):
+            lectura.fechas.add(valor(m) if callable(valor) else valor)
+        return manejar
+
+    def periodo(nombre):
+        def manejar(m, lectura):
+            lectura.periodos.add(nombre)
+        return manejar
+
+    def hora(grupo_hora, grupo_minuto=None, grupo_sufijo=None):
+        def manejar(m, lectura):
+            minuto = int(m.group(grupo_minuto)) if grupo_minuto else 0
+            sufijo = m.group(grupo_sufijo) if grupo_sufijo else None
+            lectura.horas.add((int(m.group(grupo_hora)), minuto, sufijo))
+        return manejar
+
+    def hora_aproximada(m, lectura):
+        lectura.horas.add((int(m.group(1)), 0, None))
+        lectura.aproximada = True
+
+    def hora_fija(minutos):
+        def manejar(m, lectura):
+            lectura.horas.add((int(m.group(1)), minutos, None))
+        return manejar
+
+    def hora_con_periodo(m, lectura):
+        lectura.horas.add((int(m.group(1)), 0, None))
+        lectura.periodos.add("manana" if "manana" in m.group(2) or "morning" in m.group(2) else "tarde")
+
+    return [
+        (r"\b(\d{4})-(\d{1,2})-(\d{1,2})\b",
+         fecha(lambda m: _fecha_iso(hoy, m))),
+        (rf"\b(\d{{1,2}})(?:st|nd|rd|th)?\s+(?:de\s+|of\s+)?({meses})\b",
+         fecha(lambda m: _fecha_con_mes(hoy, int(m.group(1)), MESES[m.group(2)]))),
+        (rf"\b({meses})\s+(\d{{1,2}})(?:st|nd|rd|th)?\b",
+         fecha(lambda m: _fecha_con_mes(hoy, int(m.group(2)), MESES[m.group(1)]))),
+        (r"\b(?:pasado\s+manana|day\s+after\s+tomorrow)\b", fecha(hoy + timedelta(days=2))),
+        (r"\b(?:at\s+|a\s+las\s+|a\s+la\s+|las\s+)?(\d{1,2})\s+"
+         r"(de\s+la\s+manana|in\s+the\s+morning|de\s+la\s+tarde|in\s+the\s+afternoon)\b", hora_con_periodo),
+        (r"\b(?:(?:por|en|de)\s+la\s+manana|in\s+the\s+morning|morning)\b", periodo("manana")),
+        (r"\b(?:(?:por|en|de)\s+la\s+tarde|in\s+the\s+afternoon|afternoon|tarde)\b", periodo("tarde")),
+        (r"\b(?:noon|midday|mediodia|medio\s+dia)\b", periodo("mediodia")),
+        (r"\b(?:tomorrow|manana)\b", fecha(hoy + timedelta(days=1))),
+        (r"\b(?:today|hoy)\b", fecha(hoy)),
+        (rf"\b({dias})\b", fecha(lambda m: _siguiente_dia_semana(hoy, DIAS_SEMANA[m.group(1)]))),
+        (r"\bhalf\s+past\s+(\d{1,2})\b", hora_fija(30)),
+        (r"\bquarter\s+past\s+(\d{1,2})\b", hora_fija(15)),
+        (r"\b(?:a\s+las\s+|las\s+)?(\d{1,2})\s+(?:y\s+media|and\s+a\s+half)\b", hora_fija(30)),
+        (r"\b(?:a\s+las\s+|las\s+)?(\d{1,2})\s+y\s+cuarto\b", hora_fija(15)),
+        (r"\b(?:at\s+|a\s+las\s+|las\s+)?(\d{1,2}):(\d{2})(?:\s+(am|pm))?\b", hora(1, 2, 3)),
+        (r"\b(?:at\s+|a\s+las\s+|las\s+)?(\d{1,2})\s+(am|pm)\b", hora(1, grupo_sufijo=2)),
+        (_HORA_APROXIMADA, hora_aproximada),
+        (_HORA_PREFIJADA, hora(1)),
+        (r"\b(\d{1,2})\s*(?:h|hs|horas|o\s+clock)\b", hora(1)),
+    ]
+
+
+def _fecha_iso(hoy, m):
+    try:
+        fecha = hoy.replace(year=int(m.group(1)), month=int(m.group(2)), day=int(m.group(3)))
+    except ValueError:
+        return None
+    return fecha if fecha >= hoy else None
+
+
+def _resolver_hora(lectura):
+    """Turns the collected hour and day period into 'HH:MM', or None if they conflict."""
+    if len(lectura.horas) > 1 or len(lectura.periodos) > 1:
+        return None
+    periodo = next(iter(lectura.periodos), None)
+
+    if not lectura.horas:
+        por_defecto = {"manana": HORA_MANANA, "tarde": HORA_TARDE, "mediodia": HORA_MEDIODIA}
+        return f"{por_defecto[periodo]:02d}:00" if periodo else None
+
+    h, minuto, sufijo = next(iter(lectura.horas))
+    if minuto > 59 or h > 23:
+        return None
+    if sufijo == "am" or periodo == "manana":
+        if h > 12 or h == 0 or periodo in ("tarde", "mediodia"):
+            return None
+        if h == 12:
+            return None  # "12 am" / "12 in the morning" is too ambiguous
+    elif sufijo == "pm" or periodo == "tarde":
+        if h == 0 or h > 12 and sufijo == "pm":
+            return None
+        if h < 12:
+            h += 12
+    elif periodo == "mediodia":
+        if h != 12:
+            return None
+    elif 1 <= h <= 7:
+        if 6 <= h and not lectura.aproximada:
+            return None  # "at 7" may be 07:00 for an early technician: the LLM decides
+        # Nobody books a technician at 3 in the morning: "at 3" / "around 7" mean 15:00 / 19:00
+        h += 12
+    return f"{h:02d}:{minuto:02d}"
+
+
+def interpretar_fecha_local(texto, hoy=None):
+    """Parses common date/time phrasings (English and Spanish) without calling the LLM.
+
+    Returns {"fecha": "YYYY-MM-DD", "hora": "HH:MM"} only when every word was
+    understood and date and time are unambiguous; otherwise returns None.
+    """
+    if hoy is None:
+        hoy = datetime.now()
+    if isinstance(hoy, datetime):
+        hoy = hoy.date()
+    restante = f" {_normalizar(texto)} "
+    lectura = _Lectura()
+
+    for patron, manejar in _reglas(hoy):
+        def consumir(m):
+            manejar(m, lectura)
+            return " "
+        restante = re.sub(patron, consumir, restante)
+
+    if None in lectura.fechas or len(lectura.fechas) != 1:
+        return None
+    if any(palabra not in RELLENO for palabra in restante.split()):
+        return None
+
+    hora = _resolver_hora(lectura)
+    if hora is None:
+        return None
+    return {"fecha": next(iter(lectura.fechas)).strftime("%Y-%m-%d"), "hora": hora}
+
+
+def verificar_corpus(ruta=None):
+    """Checks the parser against the expected parses in fechas_corpus.json. Returns the mismatches."""
+    ruta = ruta or Path(__file__).resolve().parent / "fechas_corpus.json"
+    with open(ruta, encoding="utf-8") as f:
+        casos = json.load(f)
+    errores = []
+    for caso in casos:
+        hoy = datetime.strptime(caso["hoy"], "%Y-%m-%d").date()
+        obtenido = interpretar_fecha_local(caso["texto"], hoy)
+        if obtenido != caso["esperado"]:
+            errores.append((caso, obtenido))
+    return errores
+
+
+if __name__ == "__main__":
+    errores = verificar_corpus()
+    for caso, obtenido in errores:
+        print(f"❌ {caso['texto']!r} (today {caso['hoy']}): expected {caso['esperado']}, got {obtenido}")
+    print(f"{'✅' if not errores else '❌'} {len(errores)} mismatches")
+    sys.exit(1 if errores else 0)
@@ -0,0 +1,27 @@
+# Production server: gunicorn -c gunicorn.conf.py
+import gc
+import os
+
+wsgi_app = "index:crear_app()"
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:8000")
+workers = int(os.getenv("GUNICORN_WORKERS", "2"))
+threads = int(os.getenv("GUNICORN_THREADS", "8"))
+
+# Holds, offered appointments and recent client updates must be seen by every worker
+os.environ.setdefault("ESTADO_BACKEND", "sqlite")
+
+# The app is built and its caches warmed once in the master; forked workers share them copy-on-write
+preload_app = True
+
+
+def on_starting(server):
+    # With per-process state, a "yes" reaching another worker finds no hold and two workers can book one block
+    if server.cfg.workers > 1 and os.getenv("ESTADO_BACKEND") != "sqlite":
+        server.log.error("ESTADO_BACKEND=%s cannot be shared by %d workers; use sqlite or workers=1",
+                         os.getenv("ESTADO_BACKEND"), server.cfg.workers)
+        raise SystemExit(1)
+
+
+def when_ready(server):
+    # Move the warm-up objects out of the collector's reach so it does not copy their pages in every worker
+    gc.freeze()
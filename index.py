@@ -1,61 +1,200 @@
-from flask import Flask, request
-import requests
-from openai import OpenAI
+from flask import Blueprint, Flask, request, jsonify, Response
 import os
 import json
+import logging
 from dotenv import load_dotenv
 from pathlib import Path
-import base64
+import atexit
+import threading
 import time
+import base64
+import hashlib
+import hmac
+from xml.sax.saxutils import escape
 from datetime import datetime, timedelta
+from citas_cache import IndiceCitas
+from campana import Campana
+from cola_escritura import ColaEscritura
+from transporte import Backend
+from despachador import Despachador
+from bloqueos import BloqueoPorClave
+from repositorio import RepositorioSheetDB, crear_repositorio
+from reservas import LibroReservas
+from ofertas import TablaOfertas
+from asignacion import AsignadorCarga
+from rafagas import Rafagas
+from cache_llm import CacheLLM, crear_cache_llm
+from metricas import configurar_logging, registro, span, iniciar_traza, terminar_traza
+from estado_conversacion import crear_almacen
+from indice_clientes import IndiceClientes
+from fechas import interpretar_fecha_local
+from intenciones import clasificar, UMBRAL_CONFIANZA, AFIRMAR, NEGAR, IDENTIDAD, REAGENDAR
+from disponibilidad import plantilla_de_horario, primer_bloque_libre, bloque_mas_cercano
 
 # Load variables from .env
 env_path = Path(__file__).resolve().parent / ".env"
 load_dotenv(dotenv_path=env_path)
 
-app = Flask(__name__)
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
-# Placeholder URLs for your SheetDB APIs
-SHEETDB_CLIENTES = "YOUR_CLIENTS_SHEETDB_URL"
-SHEETDB_TECNICOS = "YOUR_TECHNICIANS_SHEETDB_URL"
-SHEETDB_CITAS = "YOUR_APPOINTMENTS_SHEETDB_URL"
-
-# Global dictionaries for technician priority order and temporary client data
-agenda_por_tecnico = {}
-estado_temporal = {}
-historial_temporal = {}
+# Leveled logs (LOG_LEVEL) written by a background listener so request threads never wait on I/O
+configurar_logging()
+log = logging.getLogger(__name__)
+
+# Routes live in a blueprint; crear_app() builds the application (and warms the caches) on demand
+rutas = Blueprint("agente", __name__)
+
+# Twilio credentials and template SIDs are loaded once from environment variables
+TWILIO_ACCOUNT_SID = os.getenv("TWILIO_ACCOUNT_SID")
+TWILIO_AUTH_TOKEN = os.getenv("TWILIO_AUTH_TOKEN")
+TWILIO_MESSAGING_SERVICE_SID = os.getenv("TWILIO_MESSAGING_SERVICE_SID")
+TWILIO_TEMPLATE_SID = os.getenv("TWILIO_TEMPLATE_SID")
+TWILIO_WHATSAPP_NUMBER = os.getenv("TWILIO_WHATSAPP_NUMBER")
+TWILIO_API_BASE = os.getenv("TWILIO_API_BASE", "https://api.twilio.com")
+TWILIO_MESSAGES_URL = f"{TWILIO_API_BASE}/2010-04-01/Accounts/{TWILIO_ACCOUNT_SID}/Messages.json"
+
+# Shared HTTP transport: pooled keep-alive sessions with per-backend timeouts, retries and circuit breakers
+http_sheetdb = Backend("sheetdb", timeout=(3.05, 10))
+http_twilio = Backend("twilio", timeout=(3.05, 10), auth=(TWILIO_ACCOUNT_SID or "", TWILIO_AUTH_TOKEN or ""))
+http_openai = Backend("openai")
+_cliente_openai = None
+_cliente_openai_pid = None
+
+def cliente_openai():
+    """OpenAI client, built on first use and once per process (its connection pool must not cross a fork)."""
+    global _cliente_openai, _cliente_openai_pid
+    if _cliente_openai is None or _cliente_openai_pid != os.getpid():
+        # Imported here: loading the SDK is the largest part of the module's import time
+        from openai import OpenAI
+        _cliente_openai = OpenAI(api_key=os.getenv("OPENAI_API_KEY"), timeout=30.0, max_retries=2)
+        _cliente_openai_pid = os.getpid()
+    return _cliente_openai
+
+# Persistent cache of temperature-0 GPT answers shared by all workers; LLM_CACHE=0 disables it
+cache_llm = crear_cache_llm()
+
+# Placeholder URLs for your SheetDB APIs (can also be set from the environment)
+SHEETDB_CLIENTES = os.getenv("SHEETDB_CLIENTES", "YOUR_CLIENTS_SHEETDB_URL")
+SHEETDB_TECNICOS = os.getenv("SHEETDB_TECNICOS", "YOUR_TECHNICIANS_SHEETDB_URL")
+SHEETDB_CITAS = os.getenv("SHEETDB_CITAS", "YOUR_APPOINTMENTS_SHEETDB_URL")
+
+# Clients, technicians and appointments; REPOSITORIO_BACKEND=sqlite serves them from a local
+# indexed copy that is synced with the sheet in the background
+hoja = RepositorioSheetDB(
+    http_sheetdb, SHEETDB_CLIENTES, SHEETDB_TECNICOS, SHEETDB_CITAS,
+    tamano_pagina=int(os.getenv("SHEETDB_TAMANO_PAGINA", "1000"))
+)
+repositorio = crear_repositorio(hoja)
+
+# Conversation state (held proposals, message history, holds on offered blocks).
+# ESTADO_BACKEND=sqlite shares it between gunicorn workers on the same host.
+almacen = crear_almacen()
+
+# Shared index of booked blocks; avoids downloading the appointments sheet on every lookup
+indice_citas = IndiceCitas(
+    repositorio.citas,
+    ttl=int(os.getenv("CITAS_CACHE_TTL", "60"))
+)
+
+# Holds on offered blocks and just-confirmed bookings, shared through the state store, so two
+# customers are never offered the same block and a confirmation is a compare-and-set
+reservas = LibroReservas(
+    almacen,
+    duracion_retencion=int(os.getenv("RESERVA_DURACION", "600")),
+    duracion_agendado=max(3600, 2 * indice_citas.ttl)
+)
+
+# Next free offer per service type; holds, bookings and releases update it one technician at a time
+ofertas = TablaOfertas(
+    repositorio.tecnicos,
+    lambda tecnico, fecha: obtener_bloques_agendados(tecnico, fecha),
+    horizonte=int(os.getenv("OFERTAS_HORIZONTE", "10")),
+    ttl=indice_citas.ttl
+)
+reservas.al_cambiar = ofertas.actualizar
+
+# Technicians are ranked by their booked load over rolling windows (weights set from the environment)
+asignador = AsignadorCarga(
+    indice_citas,
+    dias_recientes=int(os.getenv("CARGA_DIAS_RECIENTES", "30")),
+    dias_proximos=int(os.getenv("CARGA_DIAS_PROXIMOS", "14")),
+    peso_dia=float(os.getenv("CARGA_PESO_DIA", "1")),
+    peso_proximos=float(os.getenv("CARGA_PESO_PROXIMOS", "1")),
+    peso_recientes=float(os.getenv("CARGA_PESO_RECIENTES", "0.25"))
+)
+
+# Clients indexed by phone number and identificacion; unknown numbers are negatively cached
+CLIENTES_CACHE_TTL = int(os.getenv("CLIENTES_CACHE_TTL", "300"))
+indice_clientes = IndiceClientes(
+    repositorio.clientes,
+    repositorio.clientes_por_telefono,
+    ttl=CLIENTES_CACHE_TTL
+)
+# Local client writes win over sheet data for two reload periods, by then the sheet has them.
+# They live in their own store, so a campaign's writes never evict conversation state.
+VIGENCIA_CAMBIOS_CLIENTE = 2 * CLIENTES_CACHE_TTL
+cambios_clientes = crear_almacen(
+    tabla="clientes",
+    ttl=VIGENCIA_CAMBIOS_CLIENTE,
+    max_entradas=int(os.getenv("CLIENTES_CAMBIOS_MAX_ENTRADAS", "50000"))
+)
+
+# Write-behind queue for client updates; SHEETDB_ESCRITURA_DIFERIDA=0 restores synchronous PATCHes
+cola_escritura = None
+if os.getenv("SHEETDB_ESCRITURA_DIFERIDA", "1") != "0":
+    cola_escritura = ColaEscritura(
+        repositorio.actualizar_clientes,
+        journal=os.getenv("SHEETDB_JOURNAL", str(Path(__file__).resolve().parent / "sheetdb_journal.jsonl")),
+        intervalo=float(os.getenv("SHEETDB_INTERVALO_ESCRITURA", "1"))
+    )
+    atexit.register(cola_escritura.vaciar)
 
 def obtener_estado_cliente(telefono):
-    """Fetches client data from SheetDB based on phone number."""
-    r = requests.get(f"{SHEETDB_CLIENTES}/search?telefono={telefono}").json()
-    return r[0] if r else None
+    """Fetches client data based on phone number from the in-memory client index."""
+    cliente = indice_clientes.buscar(telefono)
+    if not cliente:
+        return None
+    identificacion = str(cliente.get("identificacion"))
+    # Writes by any worker that the last sheet load may not include yet
+    cliente.update(cambios_clientes.obtener("cliente", identificacion, {}))
+    # Updates still waiting in the write-behind queue are newer than the sheet
+    if cola_escritura is not None:
+        cliente.update(cola_escritura.pendientes(cliente.get("identificacion")))
+    return cliente
+
+def actualizar_campos_en_sheetdb(identificacion, campos):
+    """Updates client fields in SheetDB, through the write-behind queue when enabled."""
+    indice_clientes.actualizar(identificacion, campos)
+    cambios_clientes.actualizar("cliente", str(identificacion), lambda previo: {**(previo or {}), **campos})
+    if cola_escritura is not None:
+        cola_escritura.encolar(identificacion, campos)
+        return
+    repositorio.actualizar_cliente(identificacion, campos)
 
 def actualizar_estado_en_sheetdb(identificacion, nuevo_estado):
     """Updates the 'estado' field for a client in SheetDB."""
-    url = f"{SHEETDB_CLIENTES}/identificacion/{identificacion}"
-    response = requests.patch(url, json={"data": {"estado": nuevo_estado}})
-    print(f"🔀 PATCH estado → {nuevo_estado} | ID: {identificacion} | Status: {response.status_code}")
-    print(f"📨 Respuesta: {response.text}")
+    actualizar_campos_en_sheetdb(identificacion, {"estado": nuevo_estado})
 
 def guardar_cita(datos):
-    """Saves appointment data to SheetDB."""
-    payload = {"data": [datos]}
-    requests.post(SHEETDB_CITAS, json=payload)
+    """Saves appointment data to the repository."""
+    repositorio.guardar_cita(datos)
+    indice_citas.registrar(datos)
 
 def interpretar_respuesta_con_gpt(prompt):
     """Interprets a user's response using GPT-3.5-turbo to determine 'yes' or 'no'."""
-    response = client.chat.completions.create(
-        model="gpt-3.5-turbo",
-        temperature=0,
-        max_tokens=3,
-        messages=[
-            {"role": "system", "content": "Respond exclusively with 'yes' or 'no'. Do not write anything else."},
-            {"role": "user", "content": prompt}
-        ]
-    )
-    content = response.choices[0].message.content
-    print(f"🧐 GPT raw: >>{content}<<")
+    def consultar():
+        response = http_openai.llamar(
+            cliente_openai().chat.completions.create,
+            model="gpt-3.5-turbo",
+            temperature=0,
+            max_tokens=3,
+            messages=[
+                {"role": "system", "content": "Respond exclusively with 'yes' or 'no'. Do not write anything else."},
+                {"role": "user", "content": prompt}
+            ]
+        )
+        return response.choices[0].message.content
+
+    content = consultar() if cache_llm is None else cache_llm.resolver("gpt-3.5-turbo", prompt, consultar)
+    log.debug("GPT raw: >>%s<<", content)
     return content.strip().lower()
 
 def enviar_mensaje_por_twilio(cliente):
@@ -65,18 +204,6 @@ def enviar_mensaje_por_twilio(cliente):
     servicio = cliente.get("servicio", "pending service")
     direccion = cliente.get("direccion", "address not registered")
 
-    # Twilio credentials and template SIDs are loaded from environment variables
-    TWILIO_ACCOUNT_SID = os.getenv("TWILIO_ACCOUNT_SID")
-    TWILIO_AUTH_TOKEN = os.getenv("TWILIO_AUTH_TOKEN")
-    TWILIO_MESSAGING_SERVICE_SID = os.getenv("TWILIO_MESSAGING_SERVICE_SID")
-    TWILIO_TEMPLATE_SID = os.getenv("TWILIO_TEMPLATE_SID")
-    TWILIO_WHATSAPP_NUMBER = os.getenv("TWILIO_WHATSAPP_NUMBER")
-
-    headers = {
-        "Authorization": "Basic " + base64.b64encode(
-            f"{TWILIO_ACCOUNT_SID}:{TWILIO_AUTH_TOKEN}".encode()).decode()
-    }
-
     data = {
         "To": f"whatsapp:{numero}",
         "From": TWILIO_WHATSAPP_NUMBER,
@@ -89,67 +216,31 @@ def enviar_mensaje_por_twilio(cliente):
         })
     }
 
-    print("📦 Final payload sent to Twilio:")
-    for k, v in data.items():
-        print(f"{k}: {v}")
-
-    url = f"https://api.twilio.com/2010-04-01/Accounts/{TWILIO_ACCOUNT_SID}/Messages.json"
-    response = requests.post(url, headers=headers, data=data)
+    log.debug("Final payload sent to Twilio: %s", data)
 
-    print(f"Status Code: {response.status_code}")
-    print(f"Response Text: {response.text}")
+    response = http_twilio.post(TWILIO_MESSAGES_URL, data=data, operacion="plantilla")
+    log.debug("Twilio response: %s %s", response.status_code, response.text)
 
     if response.status_code >= 400:
-        print("⚠️ Error sending templated message. Check ContentSid, variables, and API endpoint.")
-
-def normalizar_rango(rango):
-    """Normalizes a time range string."""
-    if not rango:
-        return ""
-    return rango.strip().replace("\u00a0", " ").replace("–", "-").replace("—", "-").replace("–", "-")
-
-def generar_bloques_de_horas(rango):
-    """Generates one-hour time blocks from a given range."""
-    try:
-        print(f"🔧 Generating blocks for range: {rango}")
-        rango = normalizar_rango(rango)
-        if "-" not in rango:
-            raise ValueError("Range does not contain '-'")
-
-        partes = [p.strip() for p in rango.split("-")]
-        if len(partes) != 2:
-            raise ValueError("Malformed range")
-
-        inicio_str = partes[0]
-        fin_str = partes[1]
+        log.warning("Error sending templated message. Check ContentSid, variables, and API endpoint.",
+                    extra={"numero": numero, "status": response.status_code, "respuesta": response.text})
+        return False
+    return True
 
-        if ':' not in inicio_str:
-            inicio_str += ":00"
-        if ':' not in fin_str:
-            fin_str += ":00"
-
-        inicio = datetime.strptime(inicio_str, "%H:%M")
-        fin = datetime.strptime(fin_str, "%H:%M")
-    except Exception as e:
-        print(f"❌ Error processing range: '{rango}' -> {e}")
-        return []
-
-    bloques = []
-    actual = inicio
-    while actual + timedelta(hours=1) <= fin:
-        fin_bloque = actual + timedelta(hours=1)
-
-        # Skip lunch break (example: 13:00-14:00)
-        if actual.strftime("%H:%M") == "13:00":
-            actual += timedelta(hours=1)
-            continue
-
-        bloque_str = f"{actual.strftime('%H:%M')} - {fin_bloque.strftime('%H:%M')}"
-        bloques.append(bloque_str)
-        actual += timedelta(hours=1)
-
-    print(f"✅ Blocks generated: {bloques}")
-    return bloques
+def enviar_texto_por_twilio(numero, texto):
+    """Sends a free-form WhatsApp reply inside an open conversation via Twilio."""
+    data = {
+        "To": f"whatsapp:{numero}",
+        "From": TWILIO_WHATSAPP_NUMBER,
+        "Body": texto
+    }
+    if TWILIO_MESSAGING_SERVICE_SID:
+        data["MessagingServiceSid"] = TWILIO_MESSAGING_SERVICE_SID
+    response = http_twilio.post(TWILIO_MESSAGES_URL, data=data, operacion="respuesta")
+    if response.status_code >= 400:
+        log.warning("Error sending reply", extra={"numero": numero, "status": response.status_code, "respuesta": response.text})
+        return False
+    return True
 
 def obtener_siguiente_dia_habil(fechas_bloqueadas):
     """Calculates the next available business day, skipping weekends and blocked dates."""
@@ -158,96 +249,100 @@ def obtener_siguiente_dia_habil(fechas_bloqueadas):
         dia += timedelta(days=1)
     return dia.strftime("%Y-%m-%d")
 
-def obtener_bloques_agendados(tecnico, fecha):
-    """Retrieves already booked time blocks for a specific technician on a given date."""
-    r = requests.get(SHEETDB_CITAS).json()
-    bloques = [cita["fechayhora"].split(" ", 1)[1]
-               for cita in r
-               if cita["nombre_tecnicos"] == tecnico and cita["fechayhora"].startswith(fecha)]
-    return set(bloques)
-
-def obtener_primer_bloque_disponible(nombre_tecnico, fecha, bloques_posibles):
-    """Finds the first available time block for a technician on a specific date."""
-    agendados = obtener_bloques_agendados(nombre_tecnico, fecha)
-    for bloque in bloques_posibles:
-        if bloque not in agendados:
-            return bloque
-    return None
+def obtener_bloques_agendados(tecnico, fecha, titular=None):
+    """Retrieves booked or held time blocks for a technician on a given date (holds of `titular` excluded)."""
+    return indice_citas.bloques(tecnico, fecha) | reservas.ocupados(tecnico, fecha, titular)
+
+def retener_propuesta(numero, fecha, bloque, tecnico):
+    """Holds the offered block for the customer and remembers the offer. False if it was just taken."""
+    if not reservas.retener(tecnico["nombre_tecnicos"], fecha, bloque, numero):
+        return False
+    descartar_propuesta(numero, conservar=(tecnico["nombre_tecnicos"], fecha, bloque))
+    almacen.guardar("propuesta", numero, {
+        "bloque": bloque,
+        "fecha": fecha,
+        "tecnico": tecnico["nombre_tecnicos"],
+        "horario_manana": tecnico.get("horario_manana", "").strip(),
+        "horario_tarde": tecnico.get("horario_tarde", "").strip()
+    })
+    return True
+
+def descartar_propuesta(numero, conservar=None):
+    """Forgets the customer's pending offer and releases its hold (unless it is `conservar`)."""
+    anterior = almacen.obtener("propuesta", numero)
+    if not anterior:
+        return
+    if (anterior["tecnico"], anterior["fecha"], anterior["bloque"]) != conservar:
+        reservas.liberar(anterior["tecnico"], anterior["fecha"], anterior["bloque"], numero)
+    almacen.borrar("propuesta", numero)
 
 def es_pregunta_de_identidad(texto):
     """Checks if the user's message is a question about the company's identity."""
-    texto = texto.lower()
-    patrones = [
-        "who are you", "who are you all", "where are you from", "what company", 
-        "who is writing to me", "who are you guys", "why are you writing to me"
-    ]
-    return any(p in texto for p in patrones)
-
-def es_negativa(texto):
-    """Checks if the user's message expresses a negative sentiment or rejection."""
-    negativas = [
-        "no", "i can't", "it doesn't work for me", "no thanks", "i prefer another",
-        "better another", "i'm not sure", "reject", "another time", "later"
-    ]
-    texto = texto.lower()
-    return any(palabra in texto for palabra in negativas)
-
-def encontrar_bloque_en_fecha(tipo_servicio, fecha, hora_deseada):
+    return IDENTIDAD in clasificar(texto).puntuaciones
+
+# Yes/no questions put to GPT-3.5 in each state (part of the cached prompt)
+PREGUNTA_AGENDAR = "Do they wish to schedule an appointment?"
+PREGUNTA_ACEPTAR = "Do they accept the proposed appointment?"
+
+def interpretar_intencion(texto, pregunta):
+    """Classifies a reply locally, asking GPT-3.5 only when the local classifier is not confident."""
+    clasificacion = clasificar(texto)
+    log.debug("Intent: %s (%s)", clasificacion.intencion, clasificacion.confianza)
+    registro.incrementar("intencion_local_total", resuelta=str(clasificacion.confianza >= UMBRAL_CONFIANZA).lower())
+    if clasificacion.confianza >= UMBRAL_CONFIANZA:
+        return clasificacion.intencion
+    respuesta = interpretar_respuesta_con_gpt(f"The client wrote: \"{texto}\". {pregunta}")
+    return AFIRMAR if any(p in respuesta for p in ["sí", "si", "quiero", "me sirve", "yes"]) else NEGAR
+
+def encontrar_bloque_en_fecha(tipo_servicio, fecha, hora_deseada, titular=None):
     """Finds an available time block for a specific service on a given date and desired time."""
-    tecnicos = consultar_tecnicos_por_servicio_prioritario(tipo_servicio)
+    compatibles = ofertas.compatibles(tipo_servicio)
+    tecnicos = asignador.ordenar(
+        [t for t in compatibles if t.get("fecha_bloqueada", "").strip() != fecha], fecha
+    )
     if not tecnicos:
-        print("❌ No compatible technicians.")
+        log.info("No compatible technicians", extra={"servicio": tipo_servicio})
         return None
 
-    print(f"📆 Searching for appointment on {fecha} at {hora_deseada} for service {tipo_servicio}")
-    print(f"👷 Compatible technicians found: {[t['nombre_tecnicos'] for t in tecnicos]}")
+    log.debug("Searching for appointment on %s at %s for service %s", fecha, hora_deseada, tipo_servicio)
+    log.debug("Compatible technicians found: %s", [t["nombre_tecnicos"] for t in tecnicos])
 
     for tecnico in tecnicos:
-        print(f"\n🔍 Verifying technician: {tecnico['nombre_tecnicos']}")
-
-        bloques = []
-
         manana = tecnico.get("horario_manana", "").strip()
         tarde = tecnico.get("horario_tarde", "").strip()
+        log.debug("Verifying technician %s (morning %s, afternoon %s)", tecnico["nombre_tecnicos"], manana, tarde)
 
-        if manana:
-            print(f"⏰ Morning schedule: {manana}")
-            bloques += generar_bloques_de_horas(manana)
-        if tarde:
-            print(f"⏰ Afternoon schedule: {tarde}")
-            bloques += generar_bloques_de_horas(tarde)
-
-        if not bloques:
-            print("⚠️ No blocks generated for this technician.")
+        plantilla = plantilla_de_horario(manana, tarde)
+        if not plantilla.bloques:
+            log.debug("No blocks generated for this technician.")
             continue
 
-        print(f"📦 Possible blocks: {bloques}")
-        agendados = obtener_bloques_agendados(tecnico["nombre_tecnicos"], fecha)
-        print(f"🛑 Booked blocks: {agendados}")
-
-        # Find the index of the exact desired block
-        idx_deseado = next(
-            (i for i, b in enumerate(bloques) if b.split(" - ")[0].strip() == hora_deseada),
-            None
-        )
-
-        if idx_deseado is None:
-            print(f"⛔ Time {hora_deseada} is not in the possible blocks for this technician.")
+        if hora_deseada not in plantilla.posicion_por_inicio:
+            log.debug("Time %s is not in the possible blocks for this technician: %s", hora_deseada, list(plantilla.bloques))
             continue
 
-        orden_bloques = sorted(bloques, key=lambda b: abs(bloques.index(b) - idx_deseado))
+        agendados = obtener_bloques_agendados(tecnico["nombre_tecnicos"], fecha, titular)
+        log.debug("Booked blocks: %s", agendados)
 
-        for bloque in orden_bloques:
-            if bloque not in agendados:
-                print(f"✅ Assigned block {bloque} with {tecnico['nombre_tecnicos']}")
-                return fecha, bloque, tecnico["nombre_tecnicos"]
+        # Closest free block to the desired one, ties going to the earlier block
+        bloque = bloque_mas_cercano(plantilla, agendados, hora_deseada)
+        if bloque:
+            log.debug("Assigned block %s with %s", bloque, tecnico["nombre_tecnicos"])
+            return fecha, bloque, tecnico
 
-    print("❌ No available block found on that day with compatible technicians.")
+    log.info("No available block found on that day with compatible technicians", extra={"fecha": fecha, "hora": hora_deseada})
     return None
 
 def interpretar_fecha_hora(texto_usuario):
     """Interprets natural language input from the user to extract a future date and time."""
     hoy = datetime.now()
+
+    # Common phrasings are parsed locally; only ambiguous messages go to GPT-4
+    local = interpretar_fecha_local(texto_usuario, hoy)
+    if local:
+        log.debug("Date parsed locally: %s", local)
+        return local
+
     prompt = f"""
 Today is {hoy.strftime('%A %d of %B of %Y')}. The client wrote: \"{texto_usuario}\".
 
@@ -274,8 +369,9 @@ If you cannot understand the date or time, respond exactly:
 {{"error": "not understood"}}
 """
 
-    try:
-        response = client.chat.completions.create(
+    def consultar():
+        response = http_openai.llamar(
+            cliente_openai().chat.completions.create,
             model="gpt-4",
             temperature=0,
             max_tokens=100,
@@ -284,143 +380,125 @@ If you cannot understand the date or time, respond exactly:
                 {"role": "user", "content": prompt}
             ]
         )
-        content = response.choices[0].message.content.strip()
-        print("📆 GPT interpreted:", content)
+        return response.choices[0].message.content.strip()
+
+    try:
+        # The prompt depends only on the message and today's date, so both make up the cache key
+        if cache_llm is None:
+            content = consultar()
+        else:
+            content = cache_llm.resolver("gpt-4", texto_usuario, consultar, contexto=hoy.strftime("%Y-%m-%d"))
+        log.debug("GPT interpreted date: %s", content)
         data = json.loads(content)
         if "fecha" in data and "hora" in data:
             return data
         else:
             return {"error": "not understood"}
     except Exception as e:
-        print(f"❌ Error in GPT interpretation: {e}")
+        log.warning("Error in GPT interpretation: %s", e)
         return {"error": "not understood"}
 
-def consultar_tecnicos_por_servicio_prioritario(tipo_servicio):
-    """Consults available technicians for a given service type, prioritizing based on historical assignments."""
-    global agenda_por_tecnico
-    tecnicos = requests.get(SHEETDB_TECNICOS).json()
-    compatibles = [t for t in tecnicos if t.get(tipo_servicio, "").strip().lower() == "si"]
-    fechas_bloqueadas = set(t.get("fecha_bloqueada", "").strip() for t in compatibles if t.get("fecha_bloqueada"))
-
-    dia_actual = datetime.now().date()
-    intentos = 0
-    max_dias = 10  # Do not search beyond 10 business days
-
-    while intentos < max_dias:
-        siguiente_dia = dia_actual + timedelta(days=1)
-        if siguiente_dia.weekday() >= 5 or siguiente_dia.strftime("%Y-%m-%d") in fechas_bloqueadas:
-            dia_actual = siguiente_dia
+def calentar_cache_llm(mensajes):
+    """Pre-computes GPT answers for past customer messages the local parsers cannot handle."""
+    calentados = 0
+    vistos = set()
+    for mensaje in mensajes:
+        clave = CacheLLM.normalizar(mensaje)
+        if not clave or clave in vistos:
             continue
+        vistos.add(clave)
+        clasificacion = clasificar(mensaje)
+        if clasificacion.confianza < UMBRAL_CONFIANZA:
+            # The same prompts interpretar_intencion sends for a reply it cannot classify locally
+            for pregunta in (PREGUNTA_AGENDAR, PREGUNTA_ACEPTAR):
+                interpretar_respuesta_con_gpt(f"The client wrote: \"{mensaje}\". {pregunta}")
+            if not clasificacion.puntuaciones:
+                # No yes/no intent at all: it may also be a date preference
+                interpretar_fecha_hora(mensaje)
+            calentados += 1
+    return calentados
 
-        fecha_str = siguiente_dia.strftime("%Y-%m-%d")
-        tecnicos_disponibles = []
-
-        tecnicos_ordenados = sorted(
-            compatibles,
-            key=lambda t: agenda_por_tecnico.get(t["nombre_tecnicos"], float('inf'))
-        )
-
-        for tecnico in tecnicos_ordenados:
-            if tecnico.get("fecha_bloqueada", "").strip() == fecha_str:
-                continue
-
-            bloques = []
-            if tecnico.get("horario_manana"):
-                bloques += generar_bloques_de_horas(tecnico["horario_manana"])
-            if tecnico.get("horario_tarde"):
-                bloques += generar_bloques_de_horas(tecnico["horario_tarde"])
-            if not bloques:
-                continue
-
-            primer_bloque = obtener_primer_bloque_disponible(tecnico["nombre_tecnicos"], fecha_str, bloques)
-            if not primer_bloque:
-                continue
-
-            if tecnico["nombre_tecnicos"] not in agenda_por_tecnico:
-                agenda_por_tecnico[tecnico["nombre_tecnicos"]] = len(agenda_por_tecnico)
-
-            tecnicos_disponibles.append({
-                "nombre_tecnicos": tecnico["nombre_tecnicos"],
-                "bloques": [primer_bloque],
-                "fecha": fecha_str,
-                "horario_manana": tecnico.get("horario_manana", "").strip(),
-                "horario_tarde": tecnico.get("horario_tarde", "").strip()
-            })
-
-        # Display technicians and schedules for debugging
-        for tecnico in compatibles:
-            print(f"\n🧾 Technician from SheetDB: {tecnico['nombre_tecnicos']}")
-            print(f"🕒 Morning schedule: {tecnico.get('horario_manana')}")
-            print(f"🕒 Afternoon schedule: {tecnico.get('horario_tarde')}")
-
-        if tecnicos_disponibles:
-            return tecnicos_disponibles
-
-        dia_actual = siguiente_dia
-        intentos += 1
+def consultar_tecnicos_por_servicio_prioritario(tipo_servicio):
+    """Next free block of each compatible technician on the first day with room, least loaded technician first."""
+    disponibles = ofertas.ofertas(tipo_servicio)
+    if not disponibles:
+        return []
+    return asignador.ordenar(disponibles, disponibles[0]["fecha"])
 
-    return []
+# Conversation states reported as metric labels; anything else in the sheet is counted as "otro"
+ESTADOS_CONVERSACION = ("esperando_confirmacion_agenda", "proponiendo_cita", "esperando_preferencia")
 
-@app.route("/whatsapp", methods=["POST"])
-def webhook():
-    """Webhook for handling incoming WhatsApp messages."""
-    numero = request.form.get("From", "").replace("whatsapp:", "")
-    mensaje = request.form.get("Body", "").strip()
-    cliente = obtener_estado_cliente(numero)
+def procesar_mensaje(numero, mensaje):
+    """Runs the conversation state machine for one inbound message and returns the reply text."""
+    with span("conversacion_busqueda_cliente"):
+        cliente = obtener_estado_cliente(numero)
     if not cliente:
-        return "<Response><Message>Could not find your information.</Message></Response>"
+        registro.incrementar("conversacion_mensajes_total", estado="desconocido")
+        return "Could not find your information."
 
     estado = cliente.get("estado", "").lower()
-    print(f"📥 Message from {numero}: {mensaje}")
-    print(f"🔹 Current state: {estado}")
+    log.info("Inbound message", extra={"numero": numero, "estado": estado})
+    log.debug("Message body: %s", mensaje)
 
+    # Each state branch is timed separately so slow paths show up in /metrics
+    etiqueta = estado if estado in ESTADOS_CONVERSACION else "otro"
+    registro.incrementar("conversacion_mensajes_total", estado=etiqueta)
+    with span("conversacion_estado", estado=etiqueta):
+        return responder_segun_estado(cliente, numero, mensaje, estado)
+
+def responder_segun_estado(cliente, numero, mensaje, estado):
+    """Handles one message for a known client according to their conversation state."""
     # Respond to identity questions
     if es_pregunta_de_identidad(mensaje):
-        return "<Response><Message>Hello 👋, we are a service provider. We are writing to you because you have a pending service with us. Would you like to schedule your pending appointment?</Message></Response>"
+        return "Hello 👋, we are a service provider. We are writing to you because you have a pending service with us. Would you like to schedule your pending appointment?"
 
     # Accumulate recent history
-    historial = historial_temporal.get(numero, "")
-    historial += " " + mensaje
-    historial_temporal[numero] = historial.strip()
+    historial = almacen.agregar_historial(numero, mensaje)
 
     if estado == "esperando_confirmacion_agenda": # Waiting for appointment confirmation
-        respuesta = interpretar_respuesta_con_gpt(f"The client wrote: \"{historial}\". Do they wish to schedule an appointment?")
-        if any(p in respuesta for p in ["sí", "si", "quiero", "me sirve", "yes"]):
+        intencion = interpretar_intencion(historial, PREGUNTA_AGENDAR)
+        if intencion == REAGENDAR:
+            actualizar_estado_en_sheetdb(cliente["identificacion"], "esperando_preferencia")
+            almacen.borrar("historial", numero)
+            return "What date and time do you prefer?"
+        if intencion == AFIRMAR:
             tipo = cliente["tipo"]
-            tecnicos = consultar_tecnicos_por_servicio_prioritario(tipo)
-            if tecnicos:
-                tecnico = tecnicos[0]
+            # The first technician whose block can still be held. Blocks another customer (or another
+            # worker) just took are refreshed in the table by each failed hold, so ask again
+            tecnico = None
+            for _ in range(3):
+                tecnicos = consultar_tecnicos_por_servicio_prioritario(tipo)
+                tecnico = next(
+                    (t for t in tecnicos if retener_propuesta(numero, t["fecha"], t["bloques"][0], t)), None
+                )
+                if tecnico or not tecnicos:
+                    break
+            if tecnico:
                 bloque = tecnico["bloques"][0]
                 fecha = tecnico["fecha"]
                 actualizar_estado_en_sheetdb(cliente["identificacion"], "proponiendo_cita")
-                estado_temporal[numero] = {
-                    "bloque": bloque,
-                    "fecha": fecha,
-                    "tecnico": tecnico["nombre_tecnicos"]
-                }
-                historial_temporal.pop(numero, None)
-                return f"<Response><Message>Perfect {cliente['nombre']}, does an appointment with technician {tecnico['nombre_tecnicos']} on {fecha} from {bloque} work for you?</Message></Response>"
+                almacen.borrar("historial", numero)
+                return f"Perfect {cliente['nombre']}, does an appointment with technician {tecnico['nombre_tecnicos']} on {fecha} from {bloque} work for you?"
             else:
                 actualizar_estado_en_sheetdb(cliente["identificacion"], "esperando_preferencia")
-                return "<Response><Message>No technicians available. What date do you prefer?</Message></Response>"
+                return "No technicians available. What date do you prefer?"
         else:
             if len(historial.strip().split()) <= 3:
-                return "<Response><Message>Hello 👋 Would you like to schedule an appointment for the service?</Message></Response>"
+                return "Hello 👋 Would you like to schedule an appointment for the service?"
             else:
                 actualizar_estado_en_sheetdb(cliente["identificacion"], "")
-                historial_temporal.pop(numero, None)
-                return "<Response><Message>Understood! You can write to us later.</Message></Response>"
+                almacen.borrar("historial", numero)
+                return "Understood! You can write to us later."
 
     elif estado == "proponiendo_cita": # Proposing an appointment
-        if es_negativa(mensaje):
+        intencion = interpretar_intencion(mensaje, PREGUNTA_ACEPTAR)
+        if intencion in (NEGAR, REAGENDAR):
+            descartar_propuesta(numero)
             actualizar_estado_en_sheetdb(cliente["identificacion"], "esperando_preferencia")
-            return "<Response><Message>What date and time do you prefer?</Message></Response>"
+            return "What date and time do you prefer?"
 
-        mensaje_limpio = mensaje.strip().lower()
-        frases_afirmativas = ["sí", "si", "me sirve", "ok", "dale", "perfecto", "vale", "claro", "de acuerdo", "sí perfecto", "sí claro", "yes", "confirm"]
-
-        if any(frase in mensaje_limpio for frase in frases_afirmativas):
-            temporal = estado_temporal.get(numero)
+        if intencion == AFIRMAR:
+            temporal = almacen.obtener("propuesta", numero)
             if temporal:
                 bloque = temporal.get("bloque")
                 fecha = temporal.get("fecha")
@@ -429,12 +507,20 @@ def webhook():
                 bloque = fecha = tecnico = None
 
             if bloque and fecha and tecnico:
-                if bloque in obtener_bloques_agendados(tecnico, fecha):
-                    siguiente_bloque = obtener_primer_bloque_disponible(tecnico, fecha, generar_bloques_de_horas("09:00 - 18:00"))
-                    if siguiente_bloque:
-                        return f"<Response><Message>Sorry, that time is no longer available. Does the block {siguiente_bloque} with {tecnico} on {fecha} work for you?</Message></Response>"
-                    else:
-                        return "<Response><Message>No available times today. Please suggest another date.</Message></Response>"
+                # Compare-and-set on the hold: fails only if the block was booked or re-held meanwhile
+                if bloque in indice_citas.bloques(tecnico, fecha) or not reservas.confirmar(tecnico, fecha, bloque, numero):
+                    fila_tecnico = {
+                        "nombre_tecnicos": tecnico,
+                        "horario_manana": temporal.get("horario_manana", ""),
+                        "horario_tarde": temporal.get("horario_tarde", "")
+                    }
+                    plantilla = plantilla_de_horario(fila_tecnico["horario_manana"], fila_tecnico["horario_tarde"])
+                    siguiente_bloque = primer_bloque_libre(plantilla, obtener_bloques_agendados(tecnico, fecha, numero))
+                    if siguiente_bloque and retener_propuesta(numero, fecha, siguiente_bloque, fila_tecnico):
+                        return f"Sorry, that time is no longer available. Does the block {siguiente_bloque} with {tecnico} on {fecha} work for you?"
+                    descartar_propuesta(numero)
+                    actualizar_estado_en_sheetdb(cliente["identificacion"], "esperando_preferencia")
+                    return "No available times today. Please suggest another date."
 
                 guardar_cita({
                     "telefono": numero,
@@ -446,59 +532,278 @@ def webhook():
                     "direccion": cliente["direccion"]
                 })
                 actualizar_estado_en_sheetdb(cliente["identificacion"], "Scheduled")
-                estado_temporal.pop(numero, None)
-                historial_temporal.pop(numero, None)
-                return f"<Response><Message>✅ Appointment confirmed for {fecha} at {bloque} with {tecnico} at {cliente['direccion']}!</Message></Response>"
+                almacen.borrar("propuesta", numero)
+                almacen.borrar("historial", numero)
+                return f"✅ Appointment confirmed for {fecha} at {bloque} with {tecnico} at {cliente['direccion']}!"
 
+        descartar_propuesta(numero)
         actualizar_estado_en_sheetdb(cliente["identificacion"], "esperando_preferencia")
-        return "<Response><Message>What date and time do you prefer?</Message></Response>"
+        return "What date and time do you prefer?"
 
     elif estado == "esperando_preferencia": # Waiting for user's preference
         interpretado = interpretar_fecha_hora(mensaje)
         if "error" in interpretado:
-            return "<Response><Message>I didn't quite understand the date and time. Can you write it differently?</Message></Response>"
+            return "I didn't quite understand the date and time. Can you write it differently?"
 
         fecha = interpretado["fecha"]
         hora = interpretado["hora"]
         tipo = cliente["tipo"]
-        propuesta = encontrar_bloque_en_fecha(tipo, fecha, hora)
+        # A lost race for the hold just means searching again, now seeing the other customer's hold
+        for _ in range(3):
+            propuesta = encontrar_bloque_en_fecha(tipo, fecha, hora, numero)
+            if not propuesta or retener_propuesta(numero, *propuesta):
+                break
+        else:
+            propuesta = None
 
         if propuesta:
             fecha, bloque, tecnico = propuesta
             actualizar_estado_en_sheetdb(cliente["identificacion"], "proponiendo_cita")
-            estado_temporal[numero] = {
-                "bloque": bloque,
-                "fecha": fecha,
-                "tecnico": tecnico
-            }
-            return f"<Response><Message>Does an appointment with {tecnico} on {fecha} at {bloque} work for you?</Message></Response>"
+            return f"Does an appointment with {tecnico['nombre_tecnicos']} on {fecha} at {bloque} work for you?"
         else:
-            return "<Response><Message>I don't have availability for that date. Would you like me to suggest another nearby time?</Message></Response>"
+            return "I don't have availability for that date. Would you like me to suggest another nearby time?"
+
+    return "I didn't understand! Please try again."
+
+def twiml(texto):
+    """Wraps a reply in a TwiML response."""
+    return f"<Response><Message>{escape(texto)}</Message></Response>"
+
+def firma_twilio_valida():
+    """Validates the X-Twilio-Signature header against the request URL and form parameters."""
+    url = os.getenv("TWILIO_WEBHOOK_URL") or request.url
+    datos = url + "".join(f"{k}{v}" for k, v in sorted(request.form.items(multi=True)))
+    esperada = base64.b64encode(hmac.new((TWILIO_AUTH_TOKEN or "").encode(), datos.encode(), hashlib.sha1).digest()).decode()
+    return hmac.compare_digest(esperada, request.headers.get("X-Twilio-Signature", ""))
+
+def responder_en_segundo_plano(numero, mensaje, turno=None):
+    """Worker job: processes a queued message (or the burst it closes) and sends the reply through the Messages API."""
+    if turno is not None:
+        mensaje = rafagas.tomar(numero, turno)
+        if mensaje is None:
+            return  # A later message of the burst replies for all of them
+    iniciar_traza()
+    try:
+        with bloqueos.bloqueo(numero):
+            respuesta = procesar_mensaje(numero, mensaje)
+        enviar_texto_por_twilio(numero, respuesta)
+    finally:
+        cerrar_traza("despachador", 200)
+
+# Webhook de-duplication by MessageSid and, with WEBHOOK_VENTANA_SEGUNDOS > 0, merging of
+# message bursts from one number into a single pass through the state machine
+rafagas = Rafagas(
+    almacen,
+    crear_almacen(
+        tabla="sids",
+        ttl=int(os.getenv("WEBHOOK_SID_TTL", "600")),
+        max_entradas=int(os.getenv("WEBHOOK_SID_MAX_ENTRADAS", "50000"))
+    ),
+    ventana=float(os.getenv("WEBHOOK_VENTANA_SEGUNDOS", "0"))
+)
+
+# Per-number lease shared by every worker process on the host, taken by both webhook modes:
+# the dispatcher keeps one number's messages in order within a process, this keeps other
+# workers out meanwhile
+bloqueos = BloqueoPorClave(
+    os.getenv("WEBHOOK_BLOQUEOS_RUTA", str(Path(__file__).resolve().parent / "webhook_bloqueos.lock"))
+)
+
+# Opt-in asynchronous webhook: acknowledge Twilio immediately and reply from a worker pool
+WEBHOOK_ASINCRONO = os.getenv("WEBHOOK_ASINCRONO", "0") == "1"
+despachador = Despachador(
+    responder_en_segundo_plano,
+    trabajadores=int(os.getenv("WEBHOOK_TRABAJADORES", "8"))
+)
+
+def cerrar_traza(ruta, status):
+    """Records a finished request trace in the metrics and logs its spans."""
+    traza = terminar_traza()
+    if traza is None:
+        return
+    registro.observar("http_peticion_seconds", traza["duracion_ms"] / 1000, ruta=ruta)
+    registro.incrementar("http_peticion_total", ruta=ruta, status=status)
+    log.info("Request finished", extra={
+        "traza": traza["id"], "ruta": ruta, "status": status,
+        "duracion_ms": traza["duracion_ms"], "spans": " ".join(traza["spans"]) or "-"
+    })
+
+@rutas.before_app_request
+def abrir_traza():
+    iniciar_traza()
+
+@rutas.after_app_request
+def registrar_traza(response):
+    cerrar_traza(request.url_rule.rule if request.url_rule else "desconocida", response.status_code)
+    return response
+
+@rutas.route("/whatsapp", methods=["POST"])
+def webhook():
+    """Webhook for handling incoming WhatsApp messages."""
+    if os.getenv("TWILIO_VALIDAR_FIRMA", "0") == "1" and not firma_twilio_valida():
+        return "Forbidden", 403
+    numero = request.form.get("From", "").replace("whatsapp:", "")
+    mensaje = request.form.get("Body", "").strip()
+    if not numero:
+        return "Bad Request", 400
 
-    return "<Response><Message>I didn't understand! Please try again.</Message></Response>"
+    sid = request.form.get("MessageSid")
+    if sid and rafagas.es_duplicado(sid):
+        return "<Response/>"  # Redelivery of a message already being handled
+    try:
+        turno = rafagas.agregar(numero, mensaje) if rafagas.ventana > 0 else None
+
+        if WEBHOOK_ASINCRONO and despachador.encolar(numero, numero, mensaje, turno, retraso=rafagas.ventana if turno else 0.0):
+            return "<Response/>"
+        # Synchronous mode (or a full worker queue): reply inline
+        if turno is not None:
+            time.sleep(rafagas.ventana)
+            mensaje = rafagas.tomar(numero, turno)
+            if mensaje is None:
+                return "<Response/>"  # A later message of the burst replies for all of them
+        with bloqueos.bloqueo(numero):
+            return twiml(procesar_mensaje(numero, mensaje))
+    except Exception:
+        if sid:
+            rafagas.olvidar(sid)  # Twilio retries on the error response: let that delivery through
+        raise
+
+def contactar_cliente(cliente):
+    """Sends the opening template to one client and marks them as contacted."""
+    if not enviar_mensaje_por_twilio(cliente):
+        return False
+    actualizar_campos_en_sheetdb(cliente["identificacion"], {"estado": "esperando_confirmacion_agenda", "contactado": "sí"})
+    return True
+
+# Outbound campaign runner; the rate limit should match the Twilio sender's throughput
+campana = Campana(
+    contactar_cliente,
+    checkpoint=os.getenv("CAMPANA_CHECKPOINT", str(Path(__file__).resolve().parent / "campana_checkpoint.jsonl")),
+    tasa=float(os.getenv("CAMPANA_MENSAJES_POR_SEGUNDO", "10")),
+    concurrencia=int(os.getenv("CAMPANA_CONCURRENCIA", "8")),
+    pendiente=None if cola_escritura is None else (
+        lambda identificacion: "contactado" in cola_escritura.pendientes(identificacion)
+    )
+)
 
 def enviar_mensajes_a_todos():
-    """Initiates contact with all clients who haven't been contacted yet."""
-    clientes = requests.get(SHEETDB_CLIENTES).json()
-    for cliente in clientes:
-        if cliente.get("contactado", "").lower() != "sí": # Not yet contacted
-            enviar_mensaje_por_twilio(cliente)
-            actualizar_estado_en_sheetdb(cliente["identificacion"], "esperando_confirmacion_agenda")
-            requests.patch(f"{SHEETDB_CLIENTES}/identificacion/{cliente['identificacion']}", json={"data": {"contactado": "sí"}})
-            time.sleep(2) # Pause to avoid hitting API rate limits
-
-@app.route("/iniciar-contacto", methods=["GET"])
+    """Initiates contact with all clients who haven't been contacted yet, in the background."""
+    # Read page by page as the campaign advances, so memory stays flat however large the sheet is
+    clientes = repositorio.clientes_por_contactar()
+    if cola_escritura is not None:
+        # Marked as contacted here but not yet in the sheet
+        clientes = (c for c in clientes if "contactado" not in cola_escritura.pendientes(c.get("identificacion")))
+    return campana.iniciar(clientes)
+
+@rutas.route("/iniciar-contacto", methods=["GET"])
 def iniciar_contacto():
     """Endpoint to trigger mass contact initiation."""
     token = request.args.get("token")
     # Use a secure token for triggering this action
     if token != os.getenv("SECRET_TRIGGER_TOKEN"):
         return "Unauthorized", 403
-    enviar_mensajes_a_todos()
-    return "Contacts initiated successfully", 200
+    if not enviar_mensajes_a_todos():
+        return "A contact campaign is already running", 409
+    return "Contacts initiated successfully", 202
+
+@rutas.route("/estado-contacto", methods=["GET"])
+def estado_contacto():
+    """Endpoint reporting progress and throughput of the contact campaign."""
+    token = request.args.get("token")
+    if token != os.getenv("SECRET_TRIGGER_TOKEN"):
+        return "Unauthorized", 403
+    return jsonify(campana.estado())
+
+def medidores():
+    """Gauges for /metrics from the caches, queues and circuit breakers of this worker."""
+    componentes = {
+        "indice_citas": indice_citas.metricas(),
+        "indice_clientes": indice_clientes.metricas(),
+        "almacen": almacen.metricas(),
+        "sids": rafagas.sids.metricas(),
+        "cambios_clientes": cambios_clientes.metricas(),
+        "despachador": despachador.metricas(),
+        "campana": campana.estado(),
+    }
+    if cola_escritura is not None:
+        componentes["cola_escritura"] = cola_escritura.metricas()
+    if cache_llm is not None:
+        componentes["cache_llm"] = cache_llm.metricas()
+    componentes["ofertas"] = ofertas.metricas()
+    valores = {}
+    for componente, datos in componentes.items():
+        for clave, valor in datos.items():
+            if isinstance(valor, (int, float)) and not isinstance(valor, bool):
+                valores.setdefault(f"agente_{componente}_{clave}", {})[()] = valor
+    valores["backend_circuito_abierto"] = {
+        (("backend", http.nombre),): int(http.interruptor.estado != "cerrado")
+        for http in (http_sheetdb, http_twilio, http_openai)
+    }
+    return valores
+
+@rutas.route("/metrics", methods=["GET"])
+def metrics():
+    """Prometheus-format latency histograms, call counts and error rates by backend and conversation state."""
+    token = os.getenv("METRICS_TOKEN")
+    if token and request.args.get("token") != token:
+        return "Unauthorized", 403
+    return Response(registro.exportar(medidores()), mimetype="text/plain; version=0.0.4")
+
+# Warm-up state reported by /ready; a preloaded gunicorn master warms up once and the workers inherit it
+calentamiento = {"listo": False, "error": None, "duracion_ms": None, "tablas_ofertas": 0}
+_lock_calentamiento = threading.Lock()
+
+def precalentar():
+    """Loads the booked blocks, the technician roster and templates, and the client index.
+
+    Run before serving (in the master with gunicorn's preload_app, so forked workers share the
+    warm, read-only structures copy-on-write). If a backend fails, the caches load lazily on
+    first use and /ready keeps reporting 503 until a retry succeeds.
+    """
+    if not _lock_calentamiento.acquire(blocking=False):
+        return False  # Already warming up
+    try:
+        inicio = time.perf_counter()
+        indice_citas.refrescar()
+        tablas = ofertas.precalentar()
+        indice_clientes.refrescar()
+        calentamiento.update(
+            listo=True, error=None, tablas_ofertas=tablas,
+            duracion_ms=round((time.perf_counter() - inicio) * 1000, 1)
+        )
+        log.info("Warm-up finished", extra={"duracion_ms": calentamiento["duracion_ms"], "tablas_ofertas": tablas})
+        return True
+    except Exception as e:
+        calentamiento["error"] = str(e)
+        log.warning("Warm-up failed: %s", e)
+        return False
+    finally:
+        _lock_calentamiento.release()
+
+@rutas.route("/ready", methods=["GET"])
+def ready():
+    """Readiness probe: 200 once the caches are warm, 503 (retrying the warm-up in the background) before."""
+    if not calentamiento["listo"] and not _lock_calentamiento.locked():
+        threading.Thread(target=precalentar, daemon=True).start()
+    return jsonify(calentamiento), 200 if calentamiento["listo"] else 503
+
+def crear_app(calentar=None):
+    """Application factory. Warms the caches before returning unless PRECALENTAR=0."""
+    app = Flask(__name__)
+    app.register_blueprint(rutas)
+    if calentar is None:
+        calentar = os.getenv("PRECALENTAR", "1") != "0"
+    if calentar and not calentamiento["listo"]:
+        precalentar()
+    return app
+
+def __getattr__(nombre):
+    # `index:app` (gunicorn, flask --app index) still works: the application is built on first access
+    if nombre == "app":
+        globals()["app"] = crear_app()
+        return globals()["app"]
+    raise AttributeError(f"module {__name__!r} has no attribute {nombre!r}")
 
 if __name__ == '__main__':
-    # For local development, run with `flask run` or a WSGI server
-    # For production, use a production-ready WSGI server like Gunicorn or uWSGI
-    # app.run(debug=True) # Do not use debug=True in production
-    pass # This line ensures the app doesn't run directly when imported
+    # Local development only; in production run `gunicorn -c gunicorn.conf.py`
+    crear_app().run(port=int(os.getenv("PORT", "5000")))
@@ -0,0 +1,128 @@
+import logging
+import re
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+def normalizar_telefono(telefono):
+    """Reduces a phone number to its digits so '+57 300-123', '57300123' and 'whatsapp:+57300123' match."""
+    return re.sub(r"\D", "", str(telefono or "").replace("whatsapp:", ""))
+
+
+class IndiceClientes:
+    """In-memory client rows indexed by normalized phone number and by identificacion.
+
+    The whole sheet is loaded in bulk and reloaded in the background on a TTL; numbers
+    that are not in the index are looked up once and, if unknown, remembered in a
+    negative cache. A reload replaces local edits, so callers overlay their own
+    recent writes on top of what `buscar` returns.
+    """
+
+    def __init__(self, cargar_todos, buscar_telefono, ttl=300, ttl_negativo=600):
+        # `cargar_todos()` returns every client row; `buscar_telefono(telefono)` returns the matching rows
+        self._cargar_todos = cargar_todos
+        self._buscar_telefono = buscar_telefono
+        self.ttl = ttl
+        self.ttl_negativo = ttl_negativo
+        self._lock = threading.Lock()
+        self._lock_recarga = threading.Lock()
+        self._por_telefono = {}
+        self._por_identificacion = {}
+        self._desconocidos = {}  # normalized phone -> expiry
+        self._cargado_en = None
+        self.aciertos = 0
+        self.fallos = 0
+        self.negativos = 0
+        self.recargas = 0
+
+    def _indexar(self, fila, por_telefono, por_identificacion):
+        telefono = normalizar_telefono(fila.get("telefono"))
+        if telefono:
+            por_telefono.setdefault(telefono, fila)  # Same as the sheet search: the first row wins
+        if fila.get("identificacion"):
+            por_identificacion[str(fila["identificacion"])] = fila
+
+    def _vigente(self):
+        return self._cargado_en is not None and time.monotonic() - self._cargado_en < self.ttl
+
+    def refrescar(self, forzar=False):
+        """Reloads every client in bulk when the TTL has expired; rows are swapped in atomically."""
+        if not forzar and self._vigente():
+            return False
+        with self._lock_recarga:
+            if not forzar and self._vigente():
+                return False
+            por_telefono, por_identificacion = {}, {}
+            for fila in self._cargar_todos():
+                self._indexar(fila, por_telefono, por_identificacion)
+            with self._lock:
+                self._por_telefono = por_telefono
+                self._por_identificacion = por_identificacion
+                self._desconocidos = {}
+                self._cargado_en = time.monotonic()
+                self.recargas += 1
+        return True
+
+    def refrescar_en_segundo_plano(self):
+        """Starts a reload without blocking the caller; the current rows keep serving meanwhile."""
+        if self._vigente() or self._lock_recarga.locked():
+            return
+        threading.Thread(target=self._refrescar_seguro, daemon=True).start()
+
+    def _refrescar_seguro(self):
+        try:
+            self.refrescar()
+        except Exception as e:
+            log.warning("Client index refresh failed: %s", e)
+
+    def buscar(self, telefono):
+        """Returns a copy of the client row for a phone number, or None if it's unknown."""
+        clave = normalizar_telefono(telefono)
+        if self._cargado_en is None:
+            self.refrescar()
+        else:
+            # Stale rows keep answering while a background reload runs
+            self.refrescar_en_segundo_plano()
+
+        with self._lock:
+            fila = self._por_telefono.get(clave)
+            if fila is not None:
+                self.aciertos += 1
+                return dict(fila)
+            if self._desconocidos.get(clave, 0) > time.monotonic():
+                self.negativos += 1
+                return None
+
+        # Not in the last bulk load: maybe a client added since then
+        self.fallos += 1
+        filas = self._buscar_telefono(telefono)
+        with self._lock:
+            if not filas:
+                if len(self._desconocidos) > 100000:
+                    self._desconocidos = {}  # Spam flood: drop the negative cache rather than grow without bound
+                self._desconocidos[clave] = time.monotonic() + self.ttl_negativo
+                return None
+            self._indexar(filas[0], self._por_telefono, self._por_identificacion)
+            return dict(filas[0])
+
+    def actualizar(self, identificacion, campos):
+        """Applies field changes made by this process to the cached row in place."""
+        with self._lock:
+            fila = self._por_identificacion.get(str(identificacion))
+            if fila is not None:
+                fila.update(campos)
+
+    def metricas(self):
+        with self._lock:
+            clientes = len(self._por_identificacion)
+            desconocidos = len(self._desconocidos)
+        return {
+            "clientes": clientes,
+            "aciertos": self.aciertos,
+            "fallos": self.fallos,
+            "negativos": self.negativos,
+            "desconocidos": desconocidos,
+            "recargas": self.recargas,
+        }
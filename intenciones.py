@@ -0,0 +1,170 @@
+import json
+import re
+import sys
+import unicodedata
+from collections import namedtuple
+from pathlib import Path
+
+AFIRMAR = "afirmar"
+NEGAR = "negar"
+IDENTIDAD = "identidad"
+REAGENDAR = "reagendar"
+
+# Below this confidence the caller should ask the LLM instead
+UMBRAL_CONFIANZA = 0.7
+
+# Intents that point the same way: a reply with both is not contradicting itself
+COMPATIBLES = {NEGAR: {REAGENDAR}, REAGENDAR: {NEGAR}}
+
+Clasificacion = namedtuple("Clasificacion", ["intencion", "confianza", "puntuaciones"])
+
+# Phrases are matched as whole tokens after lowercasing and stripping accents,
+# so "no" never matches inside "know". Longer phrases win over their prefixes
+# ("no me sirve" beats "me sirve"). Weight < 1 marks weak cues.
+FRASES = {
+    AFIRMAR: [
+        ("yes", 1), ("yeah", 1), ("yep", 1), ("sure", 1), ("ok", 1), ("okay", 1), ("of course", 1),
+        ("confirm", 1), ("confirmed", 1), ("sounds good", 1), ("that works", 1), ("works for me", 1),
+        ("perfect", 1), ("great", 1), ("fine", 0.5), ("go ahead", 1), ("lets do it", 1),
+        ("i want", 0.5), ("i would like", 0.5), ("id like", 0.5), ("no problem", 1), ("no worries", 1),
+        ("si", 1), ("claro", 1), ("dale", 1), ("vale", 1), ("perfecto", 1), ("de acuerdo", 1),
+        ("me sirve", 1), ("me parece bien", 1), ("listo", 1), ("bueno", 0.5), ("por supuesto", 1),
+        ("confirmo", 1), ("confirmado", 1), ("quiero", 0.5), ("sale", 0.5), ("excelente", 1),
+        ("genial", 1), ("correcto", 1), ("esta bien", 1), ("me queda bien", 1), ("agendemos", 1),
+        ("no hay problema", 1), ("sin problema", 1),
+    ],
+    NEGAR: [
+        ("no", 1), ("nope", 1), ("no thanks", 1), ("no thank you", 1), ("i cant", 1), ("i cannot", 1),
+        ("it doesnt work for me", 1), ("doesnt work", 1), ("not interested", 1), ("reject", 1),
+        ("im not sure", 0.5), ("not sure", 0.5), ("not now", 1), ("dont", 0.5),
+        ("no gracias", 1), ("no puedo", 1), ("no me sirve", 1), ("no me queda", 1), ("no me interesa", 1),
+        ("tampoco", 1), ("imposible", 1), ("no se", 0.5), ("no estoy seguro", 0.5), ("no estoy segura", 0.5),
+    ],
+    REAGENDAR: [
+        ("i prefer another", 1), ("better another", 1), ("another time", 1), ("another day", 1),
+        ("another hour", 1), ("different time", 1), ("different day", 1), ("later", 1),
+        ("reschedule", 1), ("other time", 1), ("change", 0.5), ("not that", 0.5),
+        ("prefiero otro", 1), ("prefiero otra", 1), ("mejor otro", 1), ("mejor otra", 1),
+        ("otro dia", 1), ("otra hora", 1), ("otro horario", 1), ("otra fecha", 1), ("mas tarde", 1),
+        ("despues", 1), ("luego", 0.5), ("reagendar", 1), ("cambiar", 1), ("otro momento", 1),
+    ],
+    IDENTIDAD: [
+        ("who are you", 1), ("who are you all", 1), ("where are you from", 1), ("what company", 1),
+        ("who is writing to me", 1), ("who are you guys", 1), ("why are you writing to me", 1),
+        ("who is this", 1), ("quien eres", 1), ("quienes son", 1), ("quien es", 1),
+        ("quienes son ustedes", 1), ("de donde son", 1), ("de donde me escriben", 1), ("que empresa", 1),
+        ("de que empresa", 1), ("quien me escribe", 1), ("por que me escriben", 1), ("quien habla", 1),
+    ],
+}
+
+# Negators outside a listed phrase: next to an affirmative phrase they turn it into a
+# refusal ("of course not", "not ok"); anywhere else the message goes to the LLM
+NEGADORES = {"not", "no", "nunca", "jamas", "dont", "wont", "never"}
+
+# Words that neither add nor remove intent; they don't lower coverage
+NEUTRAS = {
+    "hi", "hello", "hey", "thanks", "thank", "you", "please", "the", "a", "an", "it", "that", "for", "to", "and",
+    "hola", "buenas", "buenos", "dias", "tardes", "gracias", "por", "favor", "el", "la", "los", "las",
+    "de", "que", "me", "y", "a", "pues", "eh", "ah", "muchas", "mil",
+}
+
+
+def normalizar(texto):
+    """Lowercases, strips accents and apostrophes, and returns the word tokens."""
+    texto = unicodedata.normalize("NFKD", (texto or "").lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    texto = texto.replace("'", "").replace("’", "")
+    return re.findall(r"[a-z0-9]+", texto)
+
+
+def _compilar(frases):
+    """Indexes phrases by first token, longest first, for a single left-to-right scan."""
+    indice = {}
+    for intencion, lista in frases.items():
+        for frase, peso in lista:
+            tokens = tuple(normalizar(frase))
+            indice.setdefault(tokens[0], []).append((tokens, intencion, peso))
+    for candidatos in indice.values():
+        candidatos.sort(key=lambda c: -len(c[0]))
+    return indice
+
+
+_INDICE = _compilar(FRASES)
+
+
+def clasificar(texto):
+    """Classifies a message as afirmar / negar / identidad / reagendar with a confidence in [0, 1].
+
+    Returns intencion=None when nothing matched.
+    """
+    tokens = normalizar(texto)
+    coincidencias = []  # [start, end, intent, weight]
+    i = 0
+    while i < len(tokens):
+        for frase, intencion, peso in _INDICE.get(tokens[i], ()):
+            if tuple(tokens[i:i + len(frase)]) == frase:
+                coincidencias.append([i, i + len(frase), intencion, peso])
+                i += len(frase)
+                break
+        else:
+            i += 1
+
+    cubiertos = {j for inicio, fin, _, _ in coincidencias for j in range(inicio, fin)}
+    for coincidencia in coincidencias:
+        inicio, fin, intencion, _ = coincidencia
+        if intencion != AFIRMAR:
+            continue
+        for j in (inicio - 1, fin):
+            if 0 <= j < len(tokens) and j not in cubiertos and tokens[j] in NEGADORES:
+                coincidencia[2] = NEGAR
+                cubiertos.add(j)
+                break
+    negador_suelto = any(t in NEGADORES and j not in cubiertos for j, t in enumerate(tokens))
+
+    puntuaciones = {}
+    for _, _, intencion, peso in coincidencias:
+        puntuaciones[intencion] = puntuaciones.get(intencion, 0) + peso
+
+    if not puntuaciones:
+        return Clasificacion(None, 0.0, puntuaciones)
+
+    mejor = max(puntuaciones, key=puntuaciones.get)
+    if NEGAR in puntuaciones and REAGENDAR in puntuaciones:
+        mejor = REAGENDAR  # "no, another day" asks for a new date rather than ending the chat
+    a_favor = puntuaciones[mejor] + sum(puntuaciones.get(i, 0) for i in COMPATIBLES.get(mejor, ()))
+    total = sum(puntuaciones.values())
+    significativos = sum(1 for t in tokens if t not in NEUTRAS) or 1
+    cobertura = min(1.0, len(cubiertos) / significativos)
+    # Agreement between cues times how much of the message they explain
+    confianza = (a_favor / total) * min(1.0, 0.4 + 0.6 * cobertura)
+    if puntuaciones[mejor] < 1:
+        confianza *= puntuaciones[mejor]  # Weak cues alone ("fine", "no se") stay below the threshold
+    if negador_suelto:
+        confianza = min(confianza, UMBRAL_CONFIANZA / 2)  # A negation we could not place: let the LLM read it
+    return Clasificacion(mejor, round(confianza, 3), puntuaciones)
+
+
+def verificar_corpus(ruta=None):
+    """Checks the classifier against intenciones_corpus.json. Returns the mismatches.
+
+    `esperado` is the intent that must be resolved locally, or null when the
+    message must go to the LLM (confidence below UMBRAL_CONFIANZA).
+    """
+    ruta = ruta or Path(__file__).resolve().parent / "intenciones_corpus.json"
+    with open(ruta, encoding="utf-8") as f:
+        casos = json.load(f)
+    errores = []
+    for caso in casos:
+        clasificacion = clasificar(caso["texto"])
+        obtenido = clasificacion.intencion if clasificacion.confianza >= UMBRAL_CONFIANZA else None
+        if obtenido != caso["esperado"]:
+            errores.append((caso, clasificacion))
+    return errores
+
+
+if __name__ == "__main__":
+    errores = verificar_corpus()
+    for caso, clasificacion in errores:
+        print(f"❌ {caso['texto']!r}: expected {caso['esperado']}, got {clasificacion}")
+    print(f"{'✅' if not errores else '❌'} {len(errores)} mismatches")
+    sys.exit(1 if errores else 0)
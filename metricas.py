@@ -0,0 +1,196 @@
+import atexit
+import contextvars
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# Histogram bucket upper bounds, in seconds
+CUBETAS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Spans of the request being handled on this thread/context
+_traza_actual = contextvars.ContextVar("traza_actual", default=None)
+
+_CAMPOS_ESTANDAR = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+class FormatoEstructurado(logging.Formatter):
+    """'time level logger [trace] message key=value ...' with any `extra=` fields appended."""
+
+    def format(self, record):
+        base = f"{self.formatTime(record)} {record.levelname} {record.name}"
+        traza = getattr(record, "traza", None)
+        if traza:
+            base += f" [{traza}]"
+        base += f" {record.getMessage()}"
+        extras = {k: v for k, v in vars(record).items() if k not in _CAMPOS_ESTANDAR and k != "traza"}
+        if extras:
+            base += " " + " ".join(f"{k}={v}" for k, v in extras.items())
+        if record.exc_info:
+            base += "\n" + self.formatException(record.exc_info)
+        return base
+
+
+class _FiltroTraza(logging.Filter):
+    def filter(self, record):
+        # Runs on the calling thread, where the request's trace is visible; an explicit extra wins
+        if getattr(record, "traza", None) is None:
+            traza = _traza_actual.get()
+            record.traza = traza["id"] if traza else None
+        return True
+
+
+_oyente = None
+_oyente_pid = None
+_nivel = None
+
+
+def configurar_logging(nivel=None):
+    """Routes all logging through a queue so request threads never block on the output stream."""
+    global _oyente, _oyente_pid, _nivel
+    if _oyente is not None and _oyente_pid == os.getpid():
+        return
+    nivel = _nivel = (nivel or os.getenv("LOG_LEVEL", "INFO")).upper()
+    cola = queue.SimpleQueue()
+    manejador_cola = logging.handlers.QueueHandler(cola)
+    manejador_cola.addFilter(_FiltroTraza())
+    salida = logging.StreamHandler()
+    salida.setFormatter(FormatoEstructurado())
+
+    raiz = logging.getLogger()
+    for manejador in list(raiz.handlers):
+        if isinstance(manejador, logging.handlers.QueueHandler):
+            raiz.removeHandler(manejador)
+    raiz.addHandler(manejador_cola)
+    raiz.setLevel(nivel)
+
+    _oyente = logging.handlers.QueueListener(cola, salida, respect_handler_level=False)
+    _oyente.start()
+    _oyente_pid = os.getpid()
+    atexit.register(_oyente.stop)
+
+
+def _reiniciar_logging_tras_fork():
+    # A forked worker (e.g. gunicorn with preload_app) inherits the queue but not the listener thread
+    if _oyente is not None:
+        configurar_logging(_nivel)
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reiniciar_logging_tras_fork)
+
+
+class Histograma:
+    """Cumulative-bucket latency histogram (Prometheus style)."""
+
+    def __init__(self):
+        self.cubetas = [0] * len(CUBETAS)
+        self.cuenta = 0
+        self.suma = 0.0
+
+    def observar(self, valor):
+        self.cuenta += 1
+        self.suma += valor
+        for i, limite in enumerate(CUBETAS):
+            if valor <= limite:
+                self.cubetas[i] += 1
+
+
+class Registro:
+    """Process-wide latency histograms and counters keyed by metric name and labels."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histogramas = {}
+        self._contadores = {}
+
+    def observar(self, nombre, segundos, **etiquetas):
+        clave = (nombre, tuple(sorted(etiquetas.items())))
+        with self._lock:
+            self._histogramas.setdefault(clave, Histograma()).observar(segundos)
+
+    def incrementar(self, nombre, valor=1, **etiquetas):
+        clave = (nombre, tuple(sorted(etiquetas.items())))
+        with self._lock:
+            self._contadores[clave] = self._contadores.get(clave, 0) + valor
+
+    def exportar(self, medidores=None):
+        """Renders every metric in the Prometheus text format. `medidores` adds gauges {name: {labels: value}}."""
+        lineas = []
+
+        def etiquetas_a_texto(etiquetas):
+            if not etiquetas:
+                return ""
+            return "{" + ",".join(f'{k}="{str(v).replace(chr(34), "")}"' for k, v in etiquetas) + "}"
+
+        with self._lock:
+            histogramas = sorted(self._histogramas.items())
+            contadores = sorted(self._contadores.items())
+            tipos = set()
+            for (nombre, etiquetas), h in histogramas:
+                if nombre not in tipos:
+                    lineas.append(f"# TYPE {nombre} histogram")
+                    tipos.add(nombre)
+                for limite, n in zip(CUBETAS, h.cubetas):
+                    lineas.append(f"{nombre}_bucket{etiquetas_a_texto(etiquetas + (('le', limite),))} {n}")
+                lineas.append(f"{nombre}_bucket{etiquetas_a_texto(etiquetas + (('le', '+Inf'),))} {h.cuenta}")
+                lineas.append(f"{nombre}_sum{etiquetas_a_texto(etiquetas)} {h.suma:.6f}")
+                lineas.append(f"{nombre}_count{etiquetas_a_texto(etiquetas)} {h.cuenta}")
+            for (nombre, etiquetas), valor in contadores:
+                if nombre not in tipos:
+                    lineas.append(f"# TYPE {nombre} counter")
+                    tipos.add(nombre)
+                lineas.append(f"{nombre}{etiquetas_a_texto(etiquetas)} {valor}")
+
+        for nombre, valores in sorted((medidores or {}).items()):
+            lineas.append(f"# TYPE {nombre} gauge")
+            for etiquetas, valor in sorted(valores.items()):
+                lineas.append(f"{nombre}{etiquetas_a_texto(etiquetas)} {valor}")
+        return "\n".join(lineas) + "\n"
+
+
+registro = Registro()
+
+
+@contextmanager
+def span(metrica, **etiquetas):
+    """Times a block into `<metrica>_seconds` and counts it under `<metrica>_total` by outcome.
+
+    Exceptions count as errors; the block can also flag one by setting `resultado["error"] = True`.
+    """
+    inicio = time.perf_counter()
+    resultado = {"error": False}
+    try:
+        yield resultado
+    except BaseException:
+        resultado["error"] = True
+        raise
+    finally:
+        duracion = time.perf_counter() - inicio
+        error = bool(resultado["error"])
+        registro.observar(f"{metrica}_seconds", duracion, **etiquetas)
+        registro.incrementar(f"{metrica}_total", **etiquetas, error=str(error).lower())
+        traza = _traza_actual.get()
+        if traza is not None:
+            nombre = ".".join([metrica, *map(str, etiquetas.values())])
+            traza["spans"].append(f"{nombre}={duracion * 1000:.1f}ms" + ("!" if error else ""))
+
+
+def iniciar_traza():
+    """Starts collecting spans for the request handled in the current context."""
+    traza = {"id": uuid.uuid4().hex[:12], "inicio": time.perf_counter(), "spans": []}
+    _traza_actual.set(traza)
+    return traza
+
+
+def terminar_traza():
+    """Stops collecting spans and returns the finished trace (None if none was started)."""
+    traza = _traza_actual.get()
+    _traza_actual.set(None)
+    if traza is not None:
+        traza["duracion_ms"] = round((time.perf_counter() - traza["inicio"]) * 1000, 1)
+    return traza
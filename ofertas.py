@@ -0,0 +1,211 @@
+import logging
+import threading
+import time
+from datetime import date, timedelta
+
+from disponibilidad import plantilla_de_tecnico, primer_bloque_libre
+from repositorio import es_compatible
+
+log = logging.getLogger(__name__)
+
+
+class TablaOfertas:
+    """Materialized next free offer of every compatible technician, per service type.
+
+    For each service type the table holds the first business day (from tomorrow, up
+    to `horizonte` business days) on which some compatible technician has a free
+    block, and the first free block of each technician that day, in roster order.
+    Proposing a slot is then a lookup. Entries are recomputed one technician at a
+    time when a block of that day is held, booked or released (`actualizar`); the
+    whole table is rebuilt in the background on day rollover and when the roster is
+    older than `ttl`. Tables are immutable: they are computed outside the lock and
+    swapped in, so lookups never wait on the sheet. An offer can be briefly stale;
+    holding it re-validates it.
+    """
+
+    def __init__(self, cargar_tecnicos, ocupados, horizonte=10, ttl=60):
+        # `cargar_tecnicos()` yields roster rows; `ocupados(tecnico, fecha)` returns the taken blocks
+        self._cargar_tecnicos = cargar_tecnicos
+        self._ocupados = ocupados
+        self.horizonte = horizonte
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._lock_recarga = threading.Lock()
+        self._tecnicos = None
+        self._cargado_en = None
+        self._dia = None
+        self._version = 0  # Bumped by each roster reload; tables from an older roster are not stored
+        self._tablas = {}
+        self.consultas = 0
+        self.reconstrucciones = 0
+        self.actualizaciones = 0
+
+    def _recargar_tecnicos(self):
+        """Reloads the roster and rebuilds the tables in use, then swaps them all in. Caller holds _lock_recarga."""
+        dia = date.today()
+        tecnicos = list(self._cargar_tecnicos())
+        with self._lock:
+            tipos = list(self._tablas)
+        tablas = {tipo_servicio: self._construir(tecnicos, dia, tipo_servicio) for tipo_servicio in tipos}
+        with self._lock:
+            self._tecnicos, self._dia = tecnicos, dia
+            self._cargado_en = time.monotonic()
+            self._version += 1
+            self._tablas = tablas
+            self.reconstrucciones += 1
+
+    def _refrescar_seguro(self):
+        try:
+            self._recargar_tecnicos()
+        except Exception as e:
+            log.warning("Technician roster refresh failed: %s", e)
+        finally:
+            self._lock_recarga.release()
+
+    def _asegurar_tecnicos(self):
+        # Only the very first lookup waits for the roster
+        if self._tecnicos is None:
+            with self._lock_recarga:
+                if self._tecnicos is None:
+                    self._recargar_tecnicos()
+
+    def _entrada(self, tecnico, fecha):
+        """The technician's first free block on `fecha`, or None."""
+        if tecnico.get("fecha_bloqueada", "").strip() == fecha:
+            return None
+        plantilla = plantilla_de_tecnico(tecnico)
+        if not plantilla.bloques:
+            return None
+        bloque = primer_bloque_libre(plantilla, self._ocupados(tecnico["nombre_tecnicos"], fecha))
+        if not bloque:
+            return None
+        return {
+            "nombre_tecnicos": tecnico["nombre_tecnicos"],
+            "bloques": [bloque],
+            "fecha": fecha,
+            "horario_manana": tecnico.get("horario_manana", "").strip(),
+            "horario_tarde": tecnico.get("horario_tarde", "").strip()
+        }
+
+    def _construir(self, tecnicos, dia, tipo_servicio, desde=None):
+        """Walks business days after `dia` (from `desde`, if given) to the first one with a free block."""
+        compatibles = [t for t in tecnicos if es_compatible(t, tipo_servicio)]
+        bloqueadas = {t.get("fecha_bloqueada", "").strip() for t in compatibles if t.get("fecha_bloqueada")}
+
+        # Weekends and days blocked for a compatible technician are skipped without using up the horizon
+        dias = []
+        while len(dias) < self.horizonte:
+            dia += timedelta(days=1)
+            if dia.weekday() < 5 and dia.strftime("%Y-%m-%d") not in bloqueadas:
+                dias.append(dia.strftime("%Y-%m-%d"))
+
+        tabla = {"compatibles": compatibles, "dias": dias, "fecha": None, "entradas": {}}
+        for fecha in dias:
+            if desde and fecha < desde:
+                continue
+            entradas = {}
+            for tecnico in compatibles:
+                entrada = self._entrada(tecnico, fecha)
+                if entrada:
+                    entradas[tecnico["nombre_tecnicos"]] = entrada
+            if entradas:
+                tabla["fecha"], tabla["entradas"] = fecha, entradas
+                break
+        return tabla
+
+    def _tabla(self, tipo_servicio):
+        self._asegurar_tecnicos()
+        with self._lock:
+            tabla = self._tablas.get(tipo_servicio)
+            tecnicos, dia, version = self._tecnicos, self._dia, self._version
+            vencida = dia != date.today() or time.monotonic() - self._cargado_en >= self.ttl
+        if vencida and self._lock_recarga.acquire(blocking=False):
+            threading.Thread(target=self._refrescar_seguro, daemon=True).start()
+        if tabla is None:
+            tabla = self._construir(tecnicos, dia, tipo_servicio)
+            with self._lock:
+                if self._version == version:
+                    tabla = self._tablas.setdefault(tipo_servicio, tabla)
+        return tabla
+
+    def compatibles(self, tipo_servicio):
+        """Roster rows of the technicians that perform `tipo_servicio`."""
+        return list(self._tabla(tipo_servicio)["compatibles"])
+
+    def ofertas(self, tipo_servicio):
+        """Next free block of each compatible technician on the first day with room, in roster order."""
+        tabla = self._tabla(tipo_servicio)
+        hoy = date.today()
+        if tabla["fecha"] is not None and tabla["fecha"] <= hoy.strftime("%Y-%m-%d"):
+            # Past midnight, before the background rebuild lands: today's blocks are no longer offered
+            tabla = self._construir(tabla["compatibles"], hoy, tipo_servicio)
+        with self._lock:
+            self.consultas += 1
+        return [dict(e, bloques=list(e["bloques"])) for e in tabla["entradas"].values()]
+
+    def _recalcular(self, tabla, tipo_servicio, tecnico, fecha, tecnicos, dia):
+        """The table after a change to `tecnico`'s blocks on `fecha`, or None if it is not affected."""
+        if fecha not in tabla["dias"]:
+            return None
+        fila = next((t for t in tabla["compatibles"] if t["nombre_tecnicos"] == tecnico), None)
+        if fila is None:
+            return None
+        if tabla["fecha"] is None or fecha < tabla["fecha"]:
+            # A block freed before the current offer day (or when nothing was free) moves the offers earlier
+            return self._construir(tecnicos, dia, tipo_servicio)
+        if fecha != tabla["fecha"]:
+            return None
+        entrada = self._entrada(fila, fecha)
+        entradas = {}
+        for t in tabla["compatibles"]:
+            nombre = t["nombre_tecnicos"]
+            actual = entrada if nombre == tecnico else tabla["entradas"].get(nombre)
+            if actual:
+                entradas[nombre] = actual
+        if not entradas:
+            return self._construir(tecnicos, dia, tipo_servicio, desde=fecha)
+        return dict(tabla, entradas=entradas)
+
+    def actualizar(self, tecnico, fecha):
+        """Recomputes the entries affected by a hold, booking or release of one of `tecnico`'s blocks on `fecha`."""
+        with self._lock:
+            tablas = dict(self._tablas)
+            tecnicos, dia, version = self._tecnicos, self._dia, self._version
+        for tipo_servicio, tabla in tablas.items():
+            # Compare-and-swap: if another update replaced the table meanwhile, recompute on top of it
+            for _ in range(3):
+                nueva = self._recalcular(tabla, tipo_servicio, tecnico, fecha, tecnicos, dia)
+                if nueva is None:
+                    break
+                with self._lock:
+                    if self._version != version:
+                        return  # A roster reload rebuilt every table meanwhile
+                    if self._tablas.get(tipo_servicio) is tabla:
+                        self._tablas[tipo_servicio] = nueva
+                        self.actualizaciones += 1
+                        break
+                    tabla = self._tablas.get(tipo_servicio)
+                if tabla is None:
+                    break
+
+    def precalentar(self):
+        """Loads the roster, parses every schedule template and builds the table of each service type offered."""
+        with self._lock_recarga:
+            self._recargar_tecnicos()
+        tecnicos = self._tecnicos
+        for tecnico in tecnicos:
+            plantilla_de_tecnico(tecnico)
+        for tipo_servicio in {columna for t in tecnicos for columna in t if es_compatible(t, columna)}:
+            self._tabla(tipo_servicio)
+        with self._lock:
+            return len(self._tablas)
+
+    def metricas(self):
+        with self._lock:
+            tablas = len(self._tablas)
+        return {
+            "tablas": tablas,
+            "consultas": self.consultas,
+            "reconstrucciones": self.reconstrucciones,
+            "actualizaciones": self.actualizaciones,
+        }
@@ -0,0 +1,65 @@
+import time
+import uuid
+
+from metricas import registro
+
+
+class Rafagas:
+    """De-duplicates webhook deliveries and merges bursts of messages from one number.
+
+    Twilio redelivers a webhook when it times out, so each MessageSid is accepted
+    once; the SIDs go to their own short-lived store (`sids`) so they never evict
+    conversation state. Fragments sent in quick succession ("hi" / "yes" /
+    "tomorrow at 10") are collected per number; only the delivery that stays last
+    for `ventana` seconds processes the merged text. Both live in shared stores, so
+    with the SQLite backend they work across workers.
+    """
+
+    def __init__(self, almacen, sids, ventana=0.0):
+        self.almacen = almacen
+        self.sids = sids
+        self.ventana = ventana
+
+    def es_duplicado(self, sid):
+        """Records a MessageSid and returns True if it had been seen before."""
+        visto = []
+
+        def marcar(previo):
+            visto.append(previo)
+            return previo or time.time()
+
+        self.sids.actualizar("sid", sid, marcar)
+        duplicado = visto[0] is not None
+        if duplicado:
+            registro.incrementar("webhook_mensajes_total", resultado="duplicado")
+        return duplicado
+
+    def olvidar(self, sid):
+        """Forgets a MessageSid whose processing failed, so Twilio's redelivery is handled."""
+        self.sids.borrar("sid", sid)
+
+    def agregar(self, numero, mensaje):
+        """Adds a message to the number's open burst and returns this delivery's turn."""
+        turno = uuid.uuid4().hex
+        self.almacen.actualizar(
+            "rafaga", numero,
+            lambda previa: {"mensajes": (previa or {}).get("mensajes", []) + [mensaje], "turno": turno}
+        )
+        return turno
+
+    def tomar(self, numero, turno):
+        """Returns the merged burst if `turno` is still the last delivery, else None (a later one handles it)."""
+        tomada = []
+
+        def cerrar(rafaga):
+            if not rafaga or rafaga["turno"] != turno:
+                return rafaga
+            tomada.append(rafaga["mensajes"])
+            return None
+
+        self.almacen.actualizar("rafaga", numero, cerrar)
+        if not tomada:
+            registro.incrementar("webhook_mensajes_total", resultado="agrupado")
+            return None
+        registro.incrementar("webhook_mensajes_total", resultado="procesado")
+        return " ".join(m for m in tomada[0] if m).strip()
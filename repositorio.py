@@ -0,0 +1,425 @@
+import codecs
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from indice_clientes import normalizar_telefono
+from sqlite_compartido import ConexionesWAL
+
+log = logging.getLogger(__name__)
+
+
+def es_compatible(tecnico, tipo_servicio):
+    """A technician covers a service when their sheet column for it says 'si'."""
+    return str(tecnico.get(tipo_servicio, "")).strip().lower() == "si"
+
+
+def ya_contactado(cliente):
+    return str(cliente.get("contactado", "")).lower() == "sí"
+
+
+def filas_json(response, tamano_bloque=65536):
+    """Yields the objects of a JSON array response one at a time, without holding the whole body."""
+    decodificador = json.JSONDecoder()
+    texto = codecs.getincrementaldecoder(response.encoding or "utf-8")()
+    buffer = ""
+    for bloque in response.iter_content(tamano_bloque):
+        buffer += texto.decode(bloque)
+        posicion = 0
+        while True:
+            # Skip the opening bracket, separators and whitespace up to the next row
+            while posicion < len(buffer) and buffer[posicion] in "[, \t\r\n":
+                posicion += 1
+            if posicion >= len(buffer) or buffer[posicion] == "]":
+                break
+            try:
+                fila, posicion = decodificador.raw_decode(buffer, posicion)
+            except ValueError:
+                break  # Row cut at the chunk boundary; wait for more bytes
+            yield fila
+        buffer = buffer[posicion:]
+
+
+class RepositorioSheetDB:
+    """Clients, technicians and appointments read and written straight through the SheetDB API."""
+
+    def __init__(self, http, url_clientes, url_tecnicos, url_citas, tamano_pagina=1000):
+        # `http` is a transporte.Backend (pooled session, retries, circuit breaker)
+        self.http = http
+        self.url_clientes = url_clientes
+        self.url_tecnicos = url_tecnicos
+        self.url_citas = url_citas
+        self.tamano_pagina = tamano_pagina
+
+    def paginar(self, url):
+        """Yields a sheet's rows lazily, one limit/offset page at a time."""
+        desde = 0
+        while True:
+            params = {"limit": self.tamano_pagina, "offset": desde}
+            response = self.http.get(url, params=params, stream=True)
+            with response:
+                response.raise_for_status()
+                leidas = 0
+                for fila in filas_json(response):
+                    leidas += 1
+                    yield fila
+            if leidas < self.tamano_pagina:
+                return
+            desde += leidas
+
+    def clientes(self):
+        return self.paginar(self.url_clientes)
+
+    def clientes_por_contactar(self):
+        # Filtered locally: contacting a client changes the field, which would shift search offsets
+        return (c for c in self.clientes() if not ya_contactado(c))
+
+    def clientes_por_telefono(self, telefono):
+        # As params, so the leading '+' is encoded instead of read back as a space
+        return self.http.get(f"{self.url_clientes}/search", params={"telefono": telefono}).json()
+
+    def actualizar_clientes(self, lote):
+        """Applies [(identificacion, fields), ...] with one batch_update call; raises if it was not applied."""
+        data = [{"query": f"identificacion={identificacion}", **campos} for identificacion, campos in lote]
+        response = self.http.patch(f"{self.url_clientes}/batch_update", json={"data": data})
+        log.info("PATCH batch_update", extra={"filas": len(data), "status": response.status_code})
+        response.raise_for_status()
+
+    def actualizar_cliente(self, identificacion, campos):
+        response = self.http.patch(f"{self.url_clientes}/identificacion/{identificacion}", json={"data": campos})
+        log.info("PATCH client", extra={"identificacion": identificacion, "campos": campos, "status": response.status_code})
+        log.debug("SheetDB response: %s", response.text)
+
+    def tecnicos(self):
+        return self.paginar(self.url_tecnicos)
+
+    def citas(self):
+        return self.paginar(self.url_citas)
+
+    def guardar_citas(self, citas):
+        response = self.http.post(self.url_citas, json={"data": list(citas)})
+        response.raise_for_status()
+
+    def guardar_cita(self, datos):
+        response = self.http.post(self.url_citas, json={"data": [datos]})
+        if response.status_code >= 400:
+            log.warning("Error saving appointment", extra={"status": response.status_code, "respuesta": response.text})
+
+
+class RepositorioSQLite:
+    """Local SQLite (WAL) copy of the three sheets, with indexed lookups for the request path.
+
+    The sheet stays the operators' view: `sincronizar()` pushes local writes (client
+    field changes and new appointments) to it and then re-imports it. With
+    `intervalo_sincronizacion` set, one process at a time does this in the background.
+    """
+
+    def __init__(self, ruta, hoja=None, intervalo_sincronizacion=300, plazo_exportacion=600):
+        self.ruta = os.fspath(ruta)
+        self.hoja = hoja
+        self.intervalo_sincronizacion = intervalo_sincronizacion
+        self.plazo_exportacion = plazo_exportacion  # Longest an export can hold claimed appointments
+        self._conexion = ConexionesWAL(self.ruta)
+        self._lock = threading.Lock()
+        self._hilo_pid = None
+        self._importado = False
+        with self._conexion() as con:
+            con.executescript(
+                "CREATE TABLE IF NOT EXISTS clientes ("
+                " fila INTEGER PRIMARY KEY, identificacion TEXT, telefono TEXT, datos TEXT NOT NULL, cambios TEXT);"
+                "CREATE INDEX IF NOT EXISTS clientes_telefono ON clientes (telefono);"
+                "CREATE INDEX IF NOT EXISTS clientes_identificacion ON clientes (identificacion);"
+                "CREATE TABLE IF NOT EXISTS tecnicos ("
+                " fila INTEGER PRIMARY KEY, nombre_tecnicos TEXT, datos TEXT NOT NULL);"
+                "CREATE TABLE IF NOT EXISTS citas ("
+                " id INTEGER PRIMARY KEY, nombre_tecnicos TEXT, fechayhora TEXT, datos TEXT NOT NULL,"
+                " pendiente INTEGER NOT NULL DEFAULT 0, reclamado REAL);"
+                "DROP INDEX IF EXISTS citas_tecnico_fecha;"
+                "CREATE TABLE IF NOT EXISTS sincronizacion (clave TEXT PRIMARY KEY, valor REAL NOT NULL);"
+            )
+            if "reclamado" not in {columna for _, columna, *_ in con.execute("PRAGMA table_info(citas)")}:
+                con.execute("ALTER TABLE citas ADD COLUMN reclamado REAL")
+
+    def _preparar(self):
+        """Returns a connection, importing the sheet on first use and starting the background sync."""
+        con = self._conexion()
+        if self.hoja is None or (self._importado and self._hilo_pid == os.getpid()):
+            return con
+        with self._lock:
+            if not self._importado:
+                if con.execute("SELECT 1 FROM sincronizacion WHERE clave = 'importado'").fetchone() is None:
+                    self.sincronizar()
+                self._importado = True
+            if self.intervalo_sincronizacion and self._hilo_pid != os.getpid():
+                self._hilo_pid = os.getpid()
+                threading.Thread(target=self._bucle_sincronizacion, daemon=True).start()
+        return con
+
+    # --- Clients ---
+
+    def clientes(self):
+        filas = self._preparar().execute("SELECT datos FROM clientes ORDER BY fila").fetchall()
+        return [json.loads(datos) for datos, in filas]
+
+    def clientes_por_contactar(self):
+        for datos, in self._preparar().execute("SELECT datos FROM clientes ORDER BY fila"):
+            cliente = json.loads(datos)
+            if not ya_contactado(cliente):
+                yield cliente
+
+    def clientes_por_telefono(self, telefono):
+        filas = self._preparar().execute(
+            "SELECT datos FROM clientes WHERE telefono = ? ORDER BY fila", (normalizar_telefono(telefono),)
+        ).fetchall()
+        return [json.loads(datos) for datos, in filas]
+
+    def actualizar_clientes(self, lote):
+        """Applies the changes locally and remembers them for the next export to the sheet."""
+        con = self._preparar()
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            for identificacion, campos in lote:
+                for fila, datos, cambios in con.execute(
+                    "SELECT fila, datos, cambios FROM clientes WHERE identificacion = ?", (str(identificacion),)
+                ).fetchall():
+                    con.execute(
+                        "UPDATE clientes SET datos = ?, cambios = ? WHERE fila = ?",
+                        (json.dumps({**json.loads(datos), **campos}, ensure_ascii=False),
+                         json.dumps({**json.loads(cambios or "{}"), **campos}, ensure_ascii=False), fila)
+                    )
+            con.execute("COMMIT")
+        except BaseException:
+            con.execute("ROLLBACK")
+            raise
+
+    def actualizar_cliente(self, identificacion, campos):
+        self.actualizar_clientes([(identificacion, campos)])
+
+    # --- Technicians ---
+
+    def tecnicos(self):
+        filas = self._preparar().execute("SELECT datos FROM tecnicos ORDER BY fila").fetchall()
+        return [json.loads(datos) for datos, in filas]
+
+    # --- Appointments ---
+
+    def citas(self):
+        filas = self._preparar().execute("SELECT datos FROM citas ORDER BY id").fetchall()
+        return [json.loads(datos) for datos, in filas]
+
+    def guardar_citas(self, citas, pendiente=1):
+        con = self._preparar()
+        con.executemany(
+            "INSERT INTO citas (nombre_tecnicos, fechayhora, datos, pendiente) VALUES (?, ?, ?, ?)",
+            [(c.get("nombre_tecnicos"), c.get("fechayhora"), json.dumps(c, ensure_ascii=False), pendiente)
+             for c in citas]
+        )
+
+    def guardar_cita(self, datos):
+        self.guardar_citas([datos])
+
+    # --- Sync with the sheet ---
+
+    def exportar(self, hoja):
+        """Pushes client changes and new appointments made locally to the sheet.
+
+        Appointments are claimed in a transaction first, so two processes never push the
+        same one twice; anything that fails to send is put back for the next run. Client
+        changes stay recorded until the sheet has them (sending them twice is harmless).
+        """
+        con = self._conexion()
+        cambios = con.execute("SELECT identificacion, cambios FROM clientes WHERE cambios IS NOT NULL").fetchall()
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            citas = con.execute("SELECT id, datos FROM citas WHERE pendiente = 1").fetchall()
+            con.execute("UPDATE citas SET pendiente = 2, reclamado = ? WHERE pendiente = 1", (time.time(),))
+            con.execute("COMMIT")
+        except BaseException:
+            con.execute("ROLLBACK")
+            raise
+
+        lote = [(identificacion, json.loads(campos)) for identificacion, campos in cambios]
+        ids = [(id_,) for id_, _ in citas]
+        errores = []
+        if lote:
+            try:
+                hoja.actualizar_clientes(lote)
+                self._descartar_cambios(lote)
+            except Exception as e:
+                errores.append(e)
+        if citas:
+            try:
+                hoja.guardar_citas([json.loads(datos) for _, datos in citas])
+                con.executemany("UPDATE citas SET pendiente = 0 WHERE id = ?", ids)
+            except Exception as e:
+                con.executemany("UPDATE citas SET pendiente = 1 WHERE id = ?", ids)
+                errores.append(e)
+        if errores:
+            raise errores[0]
+        return len(lote), len(citas)
+
+    def _descartar_cambios(self, lote):
+        # Only fields still holding the exported value are cleared; newer local changes stay pending
+        con = self._conexion()
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            for identificacion, campos in lote:
+                for fila, cambios in con.execute(
+                    "SELECT fila, cambios FROM clientes WHERE identificacion = ? AND cambios IS NOT NULL",
+                    (str(identificacion),)
+                ).fetchall():
+                    restantes = {k: v for k, v in json.loads(cambios).items() if campos.get(k, object()) != v}
+                    con.execute(
+                        "UPDATE clientes SET cambios = ? WHERE fila = ?",
+                        (json.dumps(restantes, ensure_ascii=False) if restantes else None, fila)
+                    )
+            con.execute("COMMIT")
+        except BaseException:
+            con.execute("ROLLBACK")
+            raise
+
+    def importar(self, hoja):
+        """Replaces the local tables with the sheet's rows, keeping local writes not exported yet."""
+        # Read in full before taking the write lock, so no other process waits on the network
+        clientes, tecnicos, citas = list(hoja.clientes()), list(hoja.tecnicos()), list(hoja.citas())
+        con = self._conexion()
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            cambios = {
+                identificacion: json.loads(c)
+                for identificacion, c in con.execute(
+                    "SELECT identificacion, cambios FROM clientes WHERE cambios IS NOT NULL")
+            }
+            con.execute("DELETE FROM clientes")
+            filas = []
+            for cliente in clientes:
+                identificacion = str(cliente.get("identificacion", ""))
+                pendientes = cambios.get(identificacion)
+                if pendientes:
+                    cliente = {**cliente, **pendientes}
+                filas.append((
+                    identificacion, normalizar_telefono(cliente.get("telefono")),
+                    json.dumps(cliente, ensure_ascii=False),
+                    json.dumps(pendientes, ensure_ascii=False) if pendientes else None
+                ))
+            con.executemany("INSERT INTO clientes (identificacion, telefono, datos, cambios) VALUES (?, ?, ?, ?)", filas)
+
+            con.execute("DELETE FROM tecnicos")
+            con.executemany(
+                "INSERT INTO tecnicos (nombre_tecnicos, datos) VALUES (?, ?)",
+                [(t.get("nombre_tecnicos"), json.dumps(t, ensure_ascii=False)) for t in tecnicos]
+            )
+
+            # Appointments not exported yet are kept; everything else comes from the sheet. One
+            # left mid-export by a crash is dropped once the sheet shows it arrived, and queued
+            # for the next export otherwise.
+            con.execute("DELETE FROM citas WHERE pendiente = 0")
+            en_hoja = {(c.get("nombre_tecnicos"), c.get("fechayhora")) for c in citas}
+            con.executemany("DELETE FROM citas WHERE id = ?", [
+                (id_,) for id_, tecnico, fechayhora in con.execute(
+                    "SELECT id, nombre_tecnicos, fechayhora FROM citas WHERE pendiente = 2").fetchall()
+                if (tecnico, fechayhora) in en_hoja
+            ])
+            con.execute(
+                "UPDATE citas SET pendiente = 1 WHERE pendiente = 2 AND (reclamado IS NULL OR reclamado < ?)",
+                (time.time() - self.plazo_exportacion,)
+            )
+            con.executemany(
+                "INSERT INTO citas (nombre_tecnicos, fechayhora, datos, pendiente) VALUES (?, ?, ?, 0)",
+                [(c.get("nombre_tecnicos"), c.get("fechayhora"), json.dumps(c, ensure_ascii=False)) for c in citas]
+            )
+            con.execute("INSERT OR REPLACE INTO sincronizacion (clave, valor) VALUES ('importado', ?)", (time.time(),))
+            con.execute("COMMIT")
+        except BaseException:
+            con.execute("ROLLBACK")
+            raise
+        return len(clientes), len(tecnicos), len(citas)
+
+    def sincronizar(self):
+        """Exports local writes to the sheet, then re-imports it."""
+        exportados = self.exportar(self.hoja)
+        importados = self.importar(self.hoja)
+        log.info("Repository synced with the sheet", extra={"exportados": exportados, "importados": importados})
+
+    def _reclamar_turno(self):
+        """Compare-and-set on the last sync time, so only one process syncs per interval."""
+        con = self._conexion()
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            fila = con.execute("SELECT valor FROM sincronizacion WHERE clave = 'turno'").fetchone()
+            ahora = time.time()
+            libre = fila is None or ahora - fila[0] >= self.intervalo_sincronizacion
+            if libre:
+                con.execute("INSERT OR REPLACE INTO sincronizacion (clave, valor) VALUES ('turno', ?)", (ahora,))
+            con.execute("COMMIT")
+        except BaseException:
+            con.execute("ROLLBACK")
+            raise
+        return libre
+
+    def _bucle_sincronizacion(self):
+        while True:
+            time.sleep(self.intervalo_sincronizacion)
+            try:
+                if self._reclamar_turno():
+                    self.sincronizar()
+            except Exception as e:
+                log.warning("Repository sync failed, will retry: %s", e)
+
+
+def crear_repositorio(hoja):
+    """Builds the repository selected by REPOSITORIO_BACKEND (sheetdb | sqlite) on top of the SheetDB one."""
+    if os.getenv("REPOSITORIO_BACKEND", "sheetdb") == "sqlite":
+        ruta = os.getenv("REPOSITORIO_SQLITE_RUTA", os.path.join(os.path.dirname(os.path.abspath(__file__)), "repositorio.db"))
+        return RepositorioSQLite(ruta, hoja, intervalo_sincronizacion=float(os.getenv("REPOSITORIO_SINCRONIZACION", "300")))
+    return hoja
+
+
+def verificar_contrato(hoja, local, muestras=20):
+    """Imports `hoja` into `local` and checks both answer the same queries alike. Returns the mismatches."""
+    local.importar(hoja)
+    telefonos = [c.get("telefono") for c in list(hoja.clientes())[:muestras]]
+    consultas = (
+        [("clientes", ()), ("clientes_por_contactar", ()), ("tecnicos", ()), ("citas", ())]
+        + [("clientes_por_telefono", (t,)) for t in telefonos + ["+10000000000"]]
+    )
+    errores = []
+    for metodo, argumentos in consultas:
+        esperado, obtenido = list(getattr(hoja, metodo)(*argumentos)), list(getattr(local, metodo)(*argumentos))
+        if esperado != obtenido:
+            errores.append((metodo, argumentos, esperado, obtenido))
+    return errores
+
+
+if __name__ == "__main__":
+    # Manual sync for operators: `python repositorio.py [exportar|importar|sincronizar|verificar]`
+    from dotenv import load_dotenv
+
+    from transporte import Backend
+
+    load_dotenv(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".env"))
+    logging.basicConfig(level=logging.INFO)
+    hoja = RepositorioSheetDB(Backend("sheetdb"), os.getenv("SHEETDB_CLIENTES"), os.getenv("SHEETDB_TECNICOS"), os.getenv("SHEETDB_CITAS"))
+    local = RepositorioSQLite(
+        os.getenv("REPOSITORIO_SQLITE_RUTA", os.path.join(os.path.dirname(os.path.abspath(__file__)), "repositorio.db")),
+        hoja, intervalo_sincronizacion=0
+    )
+    accion = sys.argv[1] if len(sys.argv) > 1 else "sincronizar"
+    if accion == "verificar":
+        # Against a throwaway copy, so the real local database is not touched
+        with tempfile.TemporaryDirectory() as temporal:
+            errores = verificar_contrato(hoja, RepositorioSQLite(os.path.join(temporal, "contrato.db")))
+        for metodo, argumentos, esperado, obtenido in errores:
+            print(f"❌ {metodo}{argumentos}: SheetDB returned {len(esperado)} rows, SQLite {len(obtenido)}")
+        print(f"{'✅' if not errores else '❌'} {len(errores)} mismatches")
+        sys.exit(1 if errores else 0)
+    elif accion == "exportar":
+        print(f"📤 Exported (clients, appointments): {local.exportar(hoja)}")
+    elif accion == "importar":
+        print(f"📥 Imported (clients, technicians, appointments): {local.importar(hoja)}")
+    else:
+        local.sincronizar()
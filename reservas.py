@@ -0,0 +1,85 @@
+import time
+
+from metricas import registro
+
+RETENIDO = "retenido"
+AGENDADO = "agendado"
+
+
+class LibroReservas:
+    """Ledger of held and booked blocks per (technician, date), kept in the conversation state store.
+
+    Offering a block places a short hold on it for the customer; confirming turns the
+    hold into a booking only if nobody else holds or booked the block in the meantime
+    (compare-and-set under `almacen.actualizar`). Expired entries are dropped whenever
+    their (technician, date) is touched, and the store's TTL removes idle days.
+    """
+
+    def __init__(self, almacen, duracion_retencion=600, duracion_agendado=3600, al_cambiar=None):
+        self.almacen = almacen
+        # Called as al_cambiar(tecnico, fecha) after every hold, booking or release attempt
+        self.al_cambiar = al_cambiar
+        # How long an offer is kept for the customer, and how long a booking stays here
+        # (it must outlive the appointments index TTL, by then every worker has it)
+        self.duracion_retencion = duracion_retencion
+        self.duracion_agendado = duracion_agendado
+
+    @staticmethod
+    def _clave(tecnico, fecha):
+        return f"{tecnico}|{fecha}"
+
+    @staticmethod
+    def _vigentes(entradas, ahora):
+        return {bloque: e for bloque, e in (entradas or {}).items() if e["expira"] > ahora}
+
+    def _cambiar(self, tecnico, fecha, cambio):
+        """Applies `cambio(entries)` atomically; it returns (new entries, result)."""
+        resultado = []
+
+        def aplicar(entradas):
+            nuevas, valor = cambio(self._vigentes(entradas, time.time()))
+            resultado.append(valor)
+            return nuevas or None
+
+        self.almacen.actualizar("reservas", self._clave(tecnico, fecha), aplicar)
+        if self.al_cambiar is not None:
+            self.al_cambiar(tecnico, fecha)
+        return resultado[-1]
+
+    def ocupados(self, tecnico, fecha, titular=None):
+        """Blocks held or booked on that day, ignoring holds that belong to `titular`."""
+        entradas = self._vigentes(self.almacen.obtener("reservas", self._clave(tecnico, fecha)), time.time())
+        return {
+            bloque for bloque, e in entradas.items()
+            if e["estado"] == AGENDADO or e["titular"] != titular
+        }
+
+    def _tomar(self, tecnico, fecha, bloque, titular, estado, duracion):
+        def cambio(entradas):
+            actual = entradas.get(bloque)
+            if actual and (actual["estado"] == AGENDADO or actual["titular"] != titular):
+                return entradas, False
+            entradas[bloque] = {"estado": estado, "titular": titular, "expira": time.time() + duracion}
+            return entradas, True
+
+        tomado = self._cambiar(tecnico, fecha, cambio)
+        registro.incrementar("reservas_total", estado=estado, resultado="ok" if tomado else "conflicto")
+        return tomado
+
+    def retener(self, tecnico, fecha, bloque, titular):
+        """Holds a block for `titular`. Returns False if someone else holds or booked it."""
+        return self._tomar(tecnico, fecha, bloque, titular, RETENIDO, self.duracion_retencion)
+
+    def confirmar(self, tecnico, fecha, bloque, titular):
+        """Turns `titular`'s hold (or a still-free block, if the hold expired) into a booking."""
+        return self._tomar(tecnico, fecha, bloque, titular, AGENDADO, self.duracion_agendado)
+
+    def liberar(self, tecnico, fecha, bloque, titular):
+        """Drops `titular`'s hold on a block, e.g. when the customer turns the offer down."""
+        def cambio(entradas):
+            actual = entradas.get(bloque)
+            if actual and actual["estado"] == RETENIDO and actual["titular"] == titular:
+                del entradas[bloque]
+            return entradas, None
+
+        self._cambiar(tecnico, fecha, cambio)
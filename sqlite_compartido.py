@@ -0,0 +1,49 @@
+import os
+import sqlite3
+import threading
+import time
+
+
+class ConexionesWAL:
+    """Calling it returns this thread's connection to a SQLite file (WAL) shared by every worker on the host."""
+
+    def __init__(self, ruta):
+        self.ruta = os.fspath(ruta)
+        self._local = threading.local()
+
+    def __call__(self):
+        # One connection per thread and per process (connections must not cross a fork)
+        con = getattr(self._local, "con", None)
+        if con is None or self._local.pid != os.getpid():
+            con = sqlite3.connect(self.ruta, timeout=10, isolation_level=None)
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("PRAGMA synchronous=NORMAL")
+            self._local.con = con
+            self._local.pid = os.getpid()
+        return con
+
+
+class Depuracion:
+    """TTL expiry and LRU trim of a table with `expira` and `usado` columns, at most once per `intervalo`."""
+
+    def __init__(self, tabla, max_entradas, intervalo=60):
+        self.tabla = tabla
+        self.max_entradas = max_entradas
+        self.intervalo = intervalo
+        self._ultima = 0.0
+
+    def __call__(self, con):
+        """Drops expired rows, then the least recently used beyond max_entradas. Returns (expired, trimmed)."""
+        ahora = time.time()
+        if ahora - self._ultima < self.intervalo:
+            return 0, 0
+        self._ultima = ahora
+        vencidas = con.execute(f"DELETE FROM {self.tabla} WHERE expira < ?", (ahora,)).rowcount
+        sobrantes = con.execute(f"SELECT COUNT(*) FROM {self.tabla}").fetchone()[0] - self.max_entradas
+        if sobrantes <= 0:
+            return vencidas, 0
+        recortadas = con.execute(
+            f"DELETE FROM {self.tabla} WHERE rowid IN (SELECT rowid FROM {self.tabla} ORDER BY usado LIMIT ?)",
+            (sobrantes,)
+        ).rowcount
+        return vencidas, recortadas
@@ -0,0 +1,164 @@
+import os
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metricas import span
+
+# Methods that can be safely repeated after the request may have reached the server
+# (PATCH is included because every PATCH in this app sets fixed field values)
+METODOS_IDEMPOTENTES = {"GET", "HEAD", "PUT", "PATCH", "DELETE", "OPTIONS"}
+# Status codes worth retrying: the server did not process the request
+ESTADOS_REINTENTABLES = {429, 502, 503, 504}
+
+
+class CircuitoAbierto(requests.RequestException):
+    """Raised without touching the network while a backend's circuit breaker is open."""
+
+
+class Interruptor:
+    """Circuit breaker: opens after `umbral` consecutive failures and lets one probe through after `enfriamiento` seconds."""
+
+    def __init__(self, umbral=5, enfriamiento=30.0):
+        self.umbral = umbral
+        self.enfriamiento = enfriamiento
+        self._lock = threading.Lock()
+        self._fallos = 0
+        self._abierto_desde = None
+        self._sondeando = False
+
+    @property
+    def estado(self):
+        with self._lock:
+            if self._abierto_desde is None:
+                return "cerrado"
+            if time.monotonic() - self._abierto_desde >= self.enfriamiento:
+                return "semiabierto"
+            return "abierto"
+
+    def permitir(self):
+        """Returns True if a request may be attempted now."""
+        with self._lock:
+            if self._abierto_desde is None:
+                return True
+            if time.monotonic() - self._abierto_desde < self.enfriamiento or self._sondeando:
+                return False
+            self._sondeando = True
+            return True
+
+    def exito(self):
+        with self._lock:
+            self._fallos = 0
+            self._abierto_desde = None
+            self._sondeando = False
+
+    def fallo(self):
+        with self._lock:
+            self._fallos += 1
+            self._sondeando = False
+            if self._fallos >= self.umbral:
+                self._abierto_desde = time.monotonic()
+
+
+class Backend:
+    """Pooled, keep-alive HTTP client for one upstream with timeouts, jittered retries and a circuit breaker."""
+
+    def __init__(self, nombre, timeout=(3.05, 10), reintentos=2, backoff=0.3,
+                 umbral=5, enfriamiento=30.0, conexiones=20, auth=None, headers=None):
+        self.nombre = nombre
+        self.timeout = timeout
+        self.reintentos = reintentos
+        self.backoff = backoff
+        self.interruptor = Interruptor(umbral, enfriamiento)
+        self.conexiones = conexiones
+        self.auth = auth
+        self.headers = headers
+        self._sesion = None
+        self._pid = None
+        self._lock_sesion = threading.Lock()
+
+    @property
+    def sesion(self):
+        """The pooled session, opened on first use and once per process (keep-alive sockets must not cross a fork)."""
+        if self._sesion is None or self._pid != os.getpid():
+            with self._lock_sesion:
+                if self._sesion is None or self._pid != os.getpid():
+                    sesion = requests.Session()
+                    adaptador = HTTPAdapter(pool_connections=4, pool_maxsize=self.conexiones, max_retries=0)
+                    sesion.mount("https://", adaptador)
+                    sesion.mount("http://", adaptador)
+                    if self.auth:
+                        sesion.auth = self.auth
+                    if self.headers:
+                        sesion.headers.update(self.headers)
+                    self._sesion = sesion
+                    self._pid = os.getpid()
+        return self._sesion
+
+    def _dormir(self, intento):
+        # Full jitter keeps retries from many workers from arriving in lockstep
+        time.sleep(random.uniform(0, self.backoff * (2 ** intento)))
+
+    def solicitar(self, metodo, url, operacion=None, **kwargs):
+        """Sends a request through the pooled session. Raises CircuitoAbierto while the breaker is open.
+
+        The call, retries included, is timed under `operacion` (default: lectura for GET, escritura otherwise).
+        """
+        metodo = metodo.upper()
+        operacion = operacion or ("lectura" if metodo in ("GET", "HEAD") else "escritura")
+        with span("backend_peticion", backend=self.nombre, operacion=operacion) as resultado:
+            response = self._solicitar(metodo, url, **kwargs)
+            resultado["error"] = response.status_code >= 400
+            return response
+
+    def _solicitar(self, metodo, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        idempotente = metodo in METODOS_IDEMPOTENTES
+        intento = 0
+        while True:
+            if not self.interruptor.permitir():
+                raise CircuitoAbierto(f"{self.nombre}: circuit open, skipping {metodo} {url}")
+            try:
+                response = self.sesion.request(metodo, url, **kwargs)
+            except requests.RequestException as e:
+                self.interruptor.fallo()
+                # A connect timeout never reached the server, so even a POST can be repeated
+                reintentable = idempotente or isinstance(e, requests.ConnectTimeout)
+                if not reintentable or intento >= self.reintentos:
+                    raise
+            else:
+                if response.status_code < 500:
+                    self.interruptor.exito()
+                else:
+                    self.interruptor.fallo()
+                reintentable = response.status_code in ESTADOS_REINTENTABLES and (
+                    idempotente or response.status_code == 429)
+                if not reintentable or intento >= self.reintentos:
+                    return response
+            self._dormir(intento)
+            intento += 1
+
+    def get(self, url, **kwargs):
+        return self.solicitar("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.solicitar("POST", url, **kwargs)
+
+    def patch(self, url, **kwargs):
+        return self.solicitar("PATCH", url, **kwargs)
+
+    def llamar(self, funcion, *args, **kwargs):
+        """Runs an SDK call (e.g. OpenAI) under this backend's circuit breaker, timed by its `model`."""
+        with span("backend_peticion", backend=self.nombre, operacion=kwargs.get("model", "llamada")):
+            if not self.interruptor.permitir():
+                raise CircuitoAbierto(f"{self.nombre}: circuit open")
+            try:
+                resultado = funcion(*args, **kwargs)
+            except Exception:
+                self.interruptor.fallo()
+                raise
+            self.interruptor.exito()
+            return resultado